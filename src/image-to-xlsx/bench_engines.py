@@ -0,0 +1,97 @@
+# Compare speed and agreement of the surya inference engines on sample pages.
+# Usage: python bench_engines.py path/to/scan.pdf --first-page 1 --last-page 5
+import argparse
+import time
+import pretrained
+from document import Document
+from page import Page, batch_detect_tables
+from table import batch_recognize_structure
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union else 0
+
+
+def run_engine(engine, d, images):
+    pretrained.set_engine(engine)
+    start = time.perf_counter()
+    pretrained.warm_up(["model", "det_model", "layout_model"])
+    load_time = time.perf_counter() - start
+
+    pages = [Page(image, i, d) for i, image in enumerate(images, 1)]
+
+    start = time.perf_counter()
+    batch_detect_tables(pages)
+    detect_time = time.perf_counter() - start
+
+    tables = [t for p in pages for t in p.create_surya_tables()]
+    start = time.perf_counter()
+    batch_recognize_structure(tables)
+    structure_time = time.perf_counter() - start
+
+    return {
+        "load": load_time,
+        "detect": detect_time,
+        "structure": structure_time,
+        "bboxes": [[t.bbox for t in p.table_bboxes] for p in pages],
+        "cells": [len(t.table["cells"]) for t in tables],
+    }
+
+
+def compare(reference, result):
+    ious = [
+        max([iou(a, b) for b in bboxes], default=0)
+        for ref_bboxes, bboxes in zip(reference["bboxes"], result["bboxes"])
+        for a in ref_bboxes
+    ]
+    same_tables = [
+        len(a) == len(b) for a, b in zip(reference["bboxes"], result["bboxes"])
+    ]
+    cells = [
+        min(a, b) / max(a, b) if max(a, b) else 1
+        for a, b in zip(reference["cells"], result["cells"])
+    ]
+    return {
+        "pages with same table count": sum(same_tables) / len(same_tables),
+        "mean table bbox IoU": sum(ious) / len(ious) if ious else 1,
+        "mean cell count ratio": sum(cells) / len(cells) if cells else 1,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path")
+    parser.add_argument("--first-page", type=int, default=1)
+    parser.add_argument("--last-page", type=int, default=5)
+    args = parser.parse_args()
+
+    document = {
+        "name": args.input_path,
+        "path": args.input_path,
+        "pages": [(args.first_page, args.last_page)],
+    }
+    d = Document(document)
+    images = [image for _, image in d.pages]
+
+    results = {}
+    for engine in ["torch", "onnx", "onnx-int8"]:
+        # Warm-up pass so the one-time ONNX export is not measured
+        run_engine(engine, d, images[:1])
+        pretrained.release()
+        results[engine] = run_engine(engine, d, images)
+        pretrained.release()
+
+    print(f"{len(images)} pages")
+    for engine, result in results.items():
+        print(
+            f"{engine:>10}: load {result['load']:.1f}s, "
+            f"detect {result['detect'] / len(images):.2f}s/page, "
+            f"structure {result['structure'] / len(images):.2f}s/page"
+        )
+        if engine != "torch":
+            for metric, value in compare(results["torch"], result).items():
+                print(f"{'':>12}{metric}: {value:.3f}")
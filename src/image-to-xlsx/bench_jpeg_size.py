@@ -0,0 +1,70 @@
+# Compare the JPEG encodes and time per page needed to fit Textract's size
+# limit: image_below_size plus the final encode of textract_image_bytes, and
+# jpeg_below_size.
+# Usage: python bench_jpeg_size.py path/to/scan.pdf --scale 3 --max-pages 10
+import argparse
+import io
+import time
+from PIL import Image
+from definitions import ONE_MB
+from pdf_backend import open_pdf
+from utils import image_below_size, jpeg_below_size, maybe_reduce_resolution
+
+encodes = 0
+encoded_pixels = 0
+pil_save = Image.Image.save
+
+
+def counting_save(im, *args, **kwargs):
+    global encodes, encoded_pixels
+    encodes += 1
+    encoded_pixels += im.width * im.height
+    return pil_save(im, *args, **kwargs)
+
+
+def binary_search_bytes(page):
+    im = image_below_size(page, ONE_MB)
+    buffer = io.BytesIO()
+    im.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def bench(encode, pages):
+    global encodes, encoded_pixels
+    encodes, encoded_pixels = 0, 0
+    start = time.perf_counter()
+    sizes = [len(encode(page)) for page in pages]
+    page_pixels = sum(page.width * page.height for page in pages)
+    return {
+        "encodes": encodes / len(pages),
+        # Encodes of the downscaled probe count by their share of the pixels
+        "full size encodes": encoded_pixels / page_pixels,
+        "seconds": (time.perf_counter() - start) / len(pages),
+        "kb": sum(sizes) / len(sizes) / 1024,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path")
+    parser.add_argument("--scale", type=float, default=3)
+    parser.add_argument("--max-pages", type=int, default=10)
+    args = parser.parse_args()
+
+    pdf = open_pdf(args.input_path)
+    pages = [
+        maybe_reduce_resolution(pdf.render(page_num, args.scale).convert("RGB"))
+        for page_num in range(1, min(pdf.page_count, args.max_pages) + 1)
+    ]
+
+    Image.Image.save = counting_save
+    for name, encode in [
+        ("image_below_size", binary_search_bytes),
+        ("jpeg_below_size", lambda page: jpeg_below_size(page, ONE_MB)),
+    ]:
+        result = bench(encode, pages)
+        print(
+            f"{name:16} {result['encodes']:.1f} encodes "
+            f"({result['full size encodes']:.1f} full size), "
+            f"{result['seconds']:.3f}s/page, {result['kb']:.0f} KB/page"
+        )
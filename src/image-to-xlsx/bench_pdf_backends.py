@@ -0,0 +1,41 @@
+# Compare open time and per page render time of the PDF backends.
+# Usage: python bench_pdf_backends.py path/to/scan.pdf --scale 2 --max-pages 10
+import argparse
+import time
+from pdf_backend import PDF_BACKENDS, open_pdf
+
+
+def bench_backend(backend, path, scale, max_pages):
+    start = time.perf_counter()
+    pdf = open_pdf(path, backend)
+    page_count = pdf.page_count
+    open_time = time.perf_counter() - start
+
+    render_times = []
+    for page_num in range(1, min(page_count, max_pages) + 1):
+        start = time.perf_counter()
+        image = pdf.render(page_num, scale)
+        render_times.append(time.perf_counter() - start)
+
+    return {
+        "open": open_time,
+        "render per page": sum(render_times) / len(render_times),
+        "max render": max(render_times),
+        "size": image.size,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path")
+    parser.add_argument("--scale", type=float, default=2)
+    parser.add_argument("--max-pages", type=int, default=10)
+    args = parser.parse_args()
+
+    for backend in PDF_BACKENDS:
+        result = bench_backend(backend, args.input_path, args.scale, args.max_pages)
+        print(
+            f"{backend:8} open {result['open']:.3f}s, "
+            f"render {result['render per page']:.3f}s/page "
+            f"(max {result['max render']:.3f}s), size {result['size']}"
+        )
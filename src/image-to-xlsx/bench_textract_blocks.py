@@ -0,0 +1,142 @@
+# Time building the tables of a large synthetic multi-page Textract
+# response: splitting the blocks by page and walking the relationships of
+# each page through an Id dictionary, against the TextractBlocks index.
+# Usage: python bench_textract_blocks.py --pages 200 --rows 40 --cols 10
+import argparse
+import time
+from collections import defaultdict
+from textract_blocks import TextractBlocks
+
+
+def synthetic_blocks(pages, tables, rows, cols, words):
+    blocks = []
+    for page in range(1, pages + 1):
+        for t in range(tables):
+            prefix = f"{page}_{t}"
+            cell_ids, footer_ids = [], []
+            for r in range(1, rows + 1):
+                for c in range(1, cols + 1):
+                    word_ids = [f"{prefix}_w{r}_{c}_{w}" for w in range(words)]
+                    for word_id in word_ids:
+                        blocks.append(
+                            {
+                                "Id": word_id,
+                                "BlockType": "WORD",
+                                "Text": word_id,
+                                "Confidence": 99.0,
+                                "Page": page,
+                            }
+                        )
+                    cell_ids.append(f"{prefix}_c{r}_{c}")
+                    blocks.append(
+                        {
+                            "Id": cell_ids[-1],
+                            "BlockType": "CELL",
+                            "RowIndex": r,
+                            "ColumnIndex": c,
+                            "Page": page,
+                            "Relationships": [{"Type": "CHILD", "Ids": word_ids}],
+                        }
+                    )
+            footer_ids.append(f"{prefix}_f")
+            blocks.append(
+                {
+                    "Id": footer_ids[-1],
+                    "BlockType": "TABLE_FOOTER",
+                    "Page": page,
+                    "Relationships": [{"Type": "CHILD", "Ids": word_ids}],
+                }
+            )
+            blocks.append(
+                {
+                    "Id": f"{prefix}_t",
+                    "BlockType": "TABLE",
+                    "Page": page,
+                    "Relationships": [
+                        {"Type": "CHILD", "Ids": cell_ids},
+                        {"Type": "TABLE_FOOTER", "Ids": footer_ids},
+                    ],
+                }
+            )
+    return blocks
+
+
+def id_dictionary_tables(blocks):
+    # The tables as built before TextractBlocks
+    pages = {}
+    for block in blocks:
+        pages.setdefault(block.get("Page", 1), []).append(block)
+
+    results = []
+    for page_blocks in pages.values():
+        file_tables = [b for b in page_blocks if b["BlockType"] == "TABLE"]
+        id_to_block = {block["Id"]: block for block in page_blocks}
+        for table in file_tables:
+            table_cells = [
+                id_to_block[id]
+                for relationship in table.get("Relationships", [])
+                for id in relationship["Ids"]
+                if id_to_block[id]["BlockType"] == "CELL"
+            ]
+            table_data = defaultdict(lambda: defaultdict(list))
+            for cell in table_cells:
+                words = [
+                    id_to_block[id]
+                    for relationship in cell.get("Relationships", [])
+                    for id in relationship["Ids"]
+                    if id_to_block[id]["BlockType"] == "WORD"
+                ]
+                table_data[cell["RowIndex"] - 1][cell["ColumnIndex"] - 1] = [
+                    {"text": word["Text"], "confidence": word["Confidence"]}
+                    for word in words
+                ]
+            footer_text = "\n".join(
+                " ".join(
+                    id_to_block[id]["Text"]
+                    for rel in footer.get("Relationships", [])
+                    if rel["Type"] == "CHILD"
+                    for id in rel["Ids"]
+                    if id_to_block[id]["BlockType"] == "WORD"
+                )
+                for rel in table.get("Relationships", [])
+                if rel["Type"] == "TABLE_FOOTER"
+                for footer in [id_to_block[id] for id in rel["Ids"]]
+            )
+            results.append((table_data, footer_text))
+    return results
+
+
+def indexed_tables(blocks):
+    index = TextractBlocks(blocks)
+    return [
+        (index.table_data(table), index.footer_text(table))
+        for page in index.pages
+        for table in index.tables(page)
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--tables", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=40)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--words", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    blocks = synthetic_blocks(args.pages, args.tables, args.rows, args.cols, args.words)
+    print(f"{len(blocks)} blocks")
+    expected = None
+    for name, build in [
+        ("Id dictionary", id_dictionary_tables),
+        ("TextractBlocks", indexed_tables),
+    ]:
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            tables = build(blocks)
+            times.append(time.perf_counter() - start)
+        expected = expected or tables
+        assert tables == expected
+        print(f"{name:14} {min(times):.3f}s for {len(tables)} tables")
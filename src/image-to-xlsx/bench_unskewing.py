@@ -0,0 +1,59 @@
+# Compare correct_skew against the previous exhaustive full-resolution search
+# on synthetic rotated pages.
+# Usage: python bench_unskewing.py
+import time
+import numpy as np
+import cv2
+from unskewing import correct_skew, determine_score
+
+
+def exhaustive_skew(image, delta=1, limit=5):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+    angles = np.arange(-limit, limit + delta, delta)
+    scores = [determine_score(thresh, angle)[1] for angle in angles]
+    return angles[scores.index(max(scores))]
+
+
+def synthetic_page(angle, width=2480, height=3508, seed=0):
+    # A 2x rendered A4 page with rows of word-like blocks, rotated by angle
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    for y in range(200, height - 200, 60):
+        x = 200
+        while x < width - 300:
+            word = int(rng.integers(40, 220))
+            cv2.rectangle(page, (x, y), (x + word, y + 22), (0, 0, 0), -1)
+            x += word + int(rng.integers(20, 60))
+
+    M = cv2.getRotationMatrix2D((width // 2, height // 2), angle, 1.0)
+    return cv2.warpAffine(
+        page, M, (width, height), borderMode=cv2.BORDER_CONSTANT, borderValue=(255,) * 3
+    )
+
+
+if __name__ == "__main__":
+    angles = [-4.5, -2.5, -1, 0, 0.5, 1.5, 3, 4.5]
+    reference_time = fast_time = 0
+    max_difference = 0
+    for angle in angles:
+        page = synthetic_page(angle)
+
+        start = time.perf_counter()
+        reference = exhaustive_skew(page, delta=0.5, limit=5)
+        reference_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        fast, _ = correct_skew(page, delta=0.5, limit=5)
+        fast_time += time.perf_counter() - start
+
+        max_difference = max(max_difference, abs(fast - reference))
+        print(
+            f"rotated {angle:>5}: exhaustive {reference:>5}, coarse-to-fine {fast:>5}"
+        )
+
+    print(f"exhaustive: {reference_time / len(angles):.2f}s/page")
+    print(
+        f"coarse-to-fine (including full resolution warp): {fast_time / len(angles):.2f}s/page"
+    )
+    print(f"max angle difference: {max_difference}")
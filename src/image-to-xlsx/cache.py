@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+def hash_key(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, default=str).encode()
+        h.update(part)
+    return h.hexdigest()
+
+
+class DiskCache:
+    # One file per key. Reading an entry updates its mtime, so when the cache
+    # grows above max_mb the least recently used entries are deleted first
+    def __init__(self, directory, max_mb=1024):
+        self.directory = Path(directory)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.size = None
+
+    def path(self, key):
+        return self.directory / key[:2] / key
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            value = path.read_bytes()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return value
+
+    def set(self, key, value):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(value)
+        # An overwritten entry no longer counts towards the size
+        try:
+            replaced_size = path.stat().st_size
+        except FileNotFoundError:
+            replaced_size = 0
+        tmp_path.replace(path)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.entries())
+        else:
+            self.size += len(value) - replaced_size
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        for path in self.directory.glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.suffix != ".tmp":
+                yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        # Down to 90% of the limit, so eviction does not run on every write
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self.size -= size
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import defaultdict
+from pathlib import Path
+from utils import to_json
+
+
+def options_hash(options):
+    encoded = json.dumps(options, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def document_signature(document):
+    if document.get("path"):
+        stat = os.stat(document["path"])
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    return {"sha256": hashlib.sha256(document["content"]).hexdigest()}
+
+
+class PageCheckpoints:
+    # Tables of each finished page are kept in their own JSON file, so an
+    # interrupted run can resume from the first page that was not finished
+    def __init__(self, directory, document, options):
+        self.directory = Path(directory)
+        # Round trip through JSON so it compares equal to the stored meta
+        self.meta = json.loads(
+            json.dumps(
+                {
+                    "document": document_signature(document),
+                    "pages": document["pages"],
+                    "options": options_hash(options),
+                }
+            )
+        )
+        self.tables = defaultdict(list)
+
+        meta_path = self.directory / "meta.json"
+        if meta_path.is_file() and json.loads(meta_path.read_text()) != self.meta:
+            print("    Discarding checkpoints of a different file or options")
+            self.clear()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.write_json(meta_path, self.meta)
+
+    def page_path(self, page_num):
+        return self.directory / f"page_{page_num}.json"
+
+    def done_pages(self):
+        return {
+            int(path.stem.split("_")[1]) for path in self.directory.glob("page_*.json")
+        }
+
+    def add_table(self, page_num, table_num, table_matrix, footer_text):
+        self.tables[page_num].append((page_num, table_num, table_matrix, footer_text))
+
+    def save_page(self, page_num):
+        self.write_json(self.page_path(page_num), self.tables.pop(page_num, []))
+
+    def write_json(self, path, value):
+        # Write and rename, a page is never left half written
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(value, default=to_json))
+        tmp_path.replace(path)
+
+    def write_to(self, document):
+        for page_num in sorted(self.done_pages()):
+            for table in json.loads(self.page_path(page_num).read_text()):
+                document.write_table(*table)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
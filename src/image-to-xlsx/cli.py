@@ -1,6 +1,7 @@
 import sys
 import argparse
 import textwrap
+from definitions import DAEMON_SOCKET_PATH
 
 INF = 10**9
 
@@ -14,11 +15,18 @@ def parse_args():
     parser.add_argument(
         "--method",
         type=str,
-        choices={"surya+paddle", "pdf-text", "textract", "textract-pickle-debug"},
+        choices={
+            "surya+paddle",
+            "pdf-text",
+            "textract",
+            "textract-async",
+            "textract-pickle-debug",
+        },
         help=textwrap.dedent("""\
         Method to use for table recognition. Default surya+paddle. Methods:
         - surya+paddle: opensource AI table recognition using surya library and OCR each cell using Paddle
         - pdf-text: use PyMuPDF library to recognize the table (using internal PDF text), if you know the PDF comes with text
+        - textract-async: upload the document to the S3 bucket of --textract-s3-bucket and recognize the tables of all its pages with asynchronous AWS Textract jobs
         """),
         default="surya+paddle",
     )
@@ -87,12 +95,90 @@ def parse_args():
         help="When running OCR for each individual cell, add this amount of pixels in padding on the cropped image on all four sides. More or less padding may help for better OCR text recognition. Default 100 pixels",
         default=100,
     )
+    parser.add_argument(
+        "--image-pad-ratio",
+        type=float,
+        help="If set, use a padding proportional to each cell height (this ratio times the height) instead of the fixed --image-pad, which is then only used as the maximum padding. Saves memory and time with many small cells. Default 0 (fixed padding)",
+        default=0,
+    )
     parser.add_argument(
         "--compute-prefix",
         type=int,
         help="For debugging, compute only this amount of cells in the output table, since it can take too long to compute all of them. Default all cells",
         default=INF,
     )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices={"torch", "onnx", "onnx-int8"},
+        help=textwrap.dedent("""\
+        Inference engine for the surya models (surya+paddle method only). Default torch. Engines:
+        - torch: run the models with PyTorch
+        - onnx: export the detection, layout and table encoder models to ONNX once (cached in ~/.cache/image-to-xlsx) and run them with ONNX Runtime. Usually faster on CPU
+        - onnx-int8: same as onnx but with int8 dynamic quantization, also for the table decoder. Fastest on CPU, slightly less accurate
+        """),
+        default="torch",
+    )
+    parser.add_argument(
+        "--page-batch-size",
+        type=int,
+        help="Number of pages rendered and run together through the batched stages (e.g. table detection). Larger batches are faster but use more memory. Default 8",
+        default=8,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes that process pages of a document in parallel. Each worker loads its own copy of the models. Default 1 (no worker processes)",
+        default=1,
+    )
+    parser.add_argument(
+        "--pipeline-depth",
+        type=int,
+        help="If above 0, pages are rendered and preprocessed in a background thread and tables written to the Excel, or to the checkpoints with --checkpoints 1, in another one, while the models run on the current pages. Sets how many pages each stage can queue, queue depths are printed at the end. Ignored with --workers. Default 0 (no pipelining)",
+        default=0,
+    )
+    parser.add_argument(
+        "--document-workers",
+        type=int,
+        help="When input_path is a directory, number of worker processes that process documents in parallel, largest first. Each worker loads its own copy of the models and --workers is ignored. Default 1 (documents one after another)",
+        default=1,
+    )
+    parser.add_argument(
+        "--layout-scale",
+        type=float,
+        help="For PDFs, render pages at this lower scale (1 is 72 DPI) for table detection and render again only the detected tables at full resolution (scale 2). Pages without tables are never rendered at full resolution. Only for --method surya+paddle, ignored with --unskew 1. Default 0 (render whole pages at full resolution)",
+        default=0,
+    )
+    parser.add_argument(
+        "--pdf-backend",
+        choices={"pdfium", "pymupdf"},
+        help="Library used to open and render PDFs. The pdf-text method always uses pymupdf. Default pdfium",
+        default="pdfium",
+    )
+    parser.add_argument(
+        "--read-ahead",
+        type=int,
+        help="Number of pages rendered in the background ahead of the page being processed. Pages are otherwise rendered only when needed. Default 0",
+        default=0,
+    )
+    parser.add_argument(
+        "--structure-batch-size",
+        type=int,
+        help="Number of tables sent together to the surya table structure recognition model. All tables of a page batch are recognized together. Default surya's own batch size",
+        default=None,
+    )
+    parser.add_argument(
+        "--ocr-batch-size",
+        type=int,
+        help="Number of cropped cells sent together to Paddle OCR. Cells from all tables of a page batch share the same OCR batches. Default 64",
+        default=64,
+    )
+    parser.add_argument(
+        "--ocr-max-batch-mb",
+        type=int,
+        help="Maximum memory in MB used by the padded cell crops of a single OCR batch. A batch is sent earlier if it would exceed this size. Default 256",
+        default=256,
+    )
     parser.add_argument(
         "--fixed-decimal-places",
         type=int,
@@ -105,13 +191,95 @@ def parse_args():
         help="Path to pkl file with Textract response for a particular page. Use for debugging and not calling the API all the time",
         default=None,
     )
+    parser.add_argument(
+        "--checkpoints",
+        type=int,
+        choices={0, 1},
+        help="Save the tables of each finished page in a .checkpoints folder inside results, so a run that is interrupted resumes from the first unfinished page. Checkpoints are deleted once the document is saved. Default 1",
+        default=1,
+    )
+    parser.add_argument(
+        "--page-cache",
+        type=int,
+        choices={0, 1},
+        help="Cache the tables found in each page, keyed by the page pixels and the options that affect detection and OCR. Rerunning the same documents with different post-processing options (e.g. --decimal-separator) then skips detection and OCR. Default 1",
+        default=1,
+    )
+    parser.add_argument(
+        "--page-cache-max-mb",
+        type=int,
+        help="Maximum size of the page cache, the least recently used pages are evicted first. Default 1024",
+        default=1024,
+    )
+    parser.add_argument(
+        "--textract-concurrency",
+        type=int,
+        help="Number of pages of a page batch sent to Textract at the same time. Use with a --page-batch-size at least as large. Default 1 (one page at a time)",
+        default=1,
+    )
+    parser.add_argument(
+        "--textract-tps",
+        type=float,
+        help="Maximum Textract calls per second, see your account quota for AnalyzeDocument. The rate is reduced automatically while Textract throttles the calls. Default 5",
+        default=5,
+    )
+    parser.add_argument(
+        "--textract-endpoint-url",
+        type=str,
+        help="Send Textract (and S3 for textract-async) calls to this URL instead of AWS, e.g. http://127.0.0.1:8766 for textract_stub.py. Default None",
+        default=None,
+    )
+    parser.add_argument(
+        "--textract-cache",
+        type=int,
+        choices={0, 1},
+        help="Cache the Textract response of each page, keyed by the exact image sent. Sending the same page again then costs no AWS call. Default 1",
+        default=1,
+    )
+    parser.add_argument(
+        "--textract-cache-max-mb",
+        type=int,
+        help="Maximum size of the Textract response cache, the least recently used responses are evicted first. Default 1024",
+        default=1024,
+    )
+    parser.add_argument(
+        "--textract-offline",
+        type=int,
+        choices={0, 1},
+        help="Only use cached Textract responses and stop at the first page that was never sent, instead of calling AWS. Default 0",
+        default=0,
+    )
+    parser.add_argument(
+        "--textract-s3-bucket",
+        type=str,
+        help="S3 bucket where the textract-async method uploads the documents. They are deleted once Textract is done. Default None",
+        default=None,
+    )
+    parser.add_argument(
+        "--textract-async-chunk-pages",
+        type=int,
+        help="The textract-async method runs one Textract job for each chunk of this many consecutive pages, all of them at the same time. Default 100",
+        default=100,
+    )
     parser.add_argument(
         "--overwrite-existing-result",
         type=int,
         choices={0, 1},
-        help="Process document even if it was already processed before (i.e. it has its individual results directory already created). Default 0 (i.e. skip document)",
+        help="Process document even if it was already processed before with the same options and it did not change since (as recorded in results/manifest.json). Default 0 (i.e. skip document)",
         default=0,
     )
+    parser.add_argument(
+        "--use-daemon",
+        type=int,
+        choices={0, 1},
+        help="If a daemon started with `python daemon.py` is running, send the documents to it instead of loading the models in this process (0 for no, 1 for yes). Default 1",
+        default=1,
+    )
+    parser.add_argument(
+        "--daemon-socket",
+        help=f"Unix socket where the daemon listens. Default {DAEMON_SOCKET_PATH}",
+        default=DAEMON_SOCKET_PATH,
+    )
     parser.add_argument(
         "--remove-dots-and-commas",
         type=int,
@@ -0,0 +1,155 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, UnixStreamServer
+from definitions import DAEMON_SOCKET_PATH
+
+# Options that only make sense for the client process
+CLIENT_OPTIONS = {"input_path", "use_daemon", "daemon_socket"}
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request_daemon(socket_path, method, path, body=None, timeout=None):
+    connection = UnixHTTPConnection(socket_path, timeout)
+    try:
+        headers = {"Content-Type": "application/json"} if body else {}
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        return response.status, json.load(response)
+    finally:
+        connection.close()
+
+
+def daemon_running(socket_path=DAEMON_SOCKET_PATH):
+    # Unix sockets are not available on every platform
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+
+    try:
+        _, body = request_daemon(socket_path, "GET", "/health", timeout=0.5)
+        return body.get("status") == "ok"
+    except (OSError, ValueError, http.client.HTTPException):
+        return False
+
+
+def submit_job(source_path, output_dir, name, options, socket_path=DAEMON_SOCKET_PATH):
+    job = {
+        "source_path": str(source_path),
+        "output_dir": str(output_dir),
+        "name": name,
+        "options": {k: v for k, v in options.items() if k not in CLIENT_OPTIONS},
+    }
+    status, body = request_daemon(
+        socket_path, "POST", "/jobs", json.dumps(job).encode("utf-8")
+    )
+    if status != 200:
+        raise RuntimeError(f"Daemon job failed:\n{body.get('error')}")
+    return body
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # Only the user running the daemon can connect and have it read and
+        # write their files, the socket is never created with wider permissions
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+
+def serve(socket_path=DAEMON_SOCKET_PATH):
+    from pathlib import Path
+    import main
+    import pretrained
+
+    print("Loading models...")
+    pretrained.warm_up()
+
+    # Models are not thread safe, jobs run one at a time
+    job_lock = threading.Lock()
+
+    class JobHandler(BaseHTTPRequestHandler):
+        def reply(self, status, body):
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def address_string(self):
+            # Unix socket clients have no address
+            return "local"
+
+        def do_GET(self):
+            if self.path == "/health":
+                self.reply(200, {"status": "ok", "busy": job_lock.locked()})
+            else:
+                self.reply(404, {"status": "error", "error": "Not found"})
+
+        def do_POST(self):
+            if self.path != "/jobs":
+                self.reply(404, {"status": "error", "error": "Not found"})
+                return
+
+            job = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            print(f"Processing document {job['name']}")
+            try:
+                with job_lock:
+                    main.process_document(
+                        Path(job["source_path"]),
+                        Path(job["output_dir"]),
+                        job["name"],
+                        job["options"],
+                    )
+                self.reply(200, {"status": "ok", "output_dir": job["output_dir"]})
+            except Exception:
+                traceback.print_exc()
+                self.reply(500, {"status": "error", "error": traceback.format_exc()})
+
+    if daemon_running(socket_path):
+        raise SystemExit(f"A daemon is already listening on {socket_path}")
+    # Left behind by a daemon that did not shut down cleanly
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+    server = ThreadingUnixHTTPServer(socket_path, JobHandler)
+    print(f"Listening for jobs on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Keep the models loaded and process documents sent by main.py."
+    )
+    parser.add_argument(
+        "--socket",
+        help=f"Unix socket to listen on, only the current user can connect to it. Default {DAEMON_SOCKET_PATH}",
+        default=DAEMON_SOCKET_PATH,
+    )
+    serve(parser.parse_args().socket)
@@ -5,10 +5,16 @@ INF = 10**9
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 INPUT_PATH = os.path.join(ROOT_DIR, "input")
 OUTPUT_PATH = os.path.join(ROOT_DIR, "output")
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "image-to-xlsx")
+ONNX_CACHE_PATH = os.path.join(CACHE_PATH, "onnx")
+PAGE_CACHE_PATH = os.path.join(CACHE_PATH, "pages")
+TEXTRACT_CACHE_PATH = os.path.join(CACHE_PATH, "textract")
 ONE_MB = 1024 * 1024
+MIN_IMAGE_PAD = 10
 MAX_TEXTRACT_DIMENSION = 3495
 # 5 MB
 MAX_TEXTRACT_SYNC_SIZE = 5 * 1024 * 1024
+DAEMON_SOCKET_PATH = os.path.join(CACHE_PATH, "daemon.sock")
 MISSPELLINGS = {
     "H": 4,
     "U": 4,
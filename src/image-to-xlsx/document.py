@@ -1,9 +1,12 @@
-import pymupdf
-import pypdfium2
 from openpyxl import Workbook
-from utils import file_extension
+from openpyxl.styles import PatternFill, Border, Side
+from openpyxl.comments import Comment
+from utils import file_extension, get_cell_color
+from pdf_backend import open_pdf
 from PIL import Image
 from io import BytesIO
+import queue
+import threading
 
 
 class Document:
@@ -12,18 +15,43 @@ class Document:
         document,
         fixed_decimal_places=0,
         method="surya+paddle",
+        read_ahead=0,
+        layout_scale=0,
+        pdf_backend="pdfium",
+        checkpoints=None,
+        page_cache=None,
     ):
         self.method = method
+        self.render_scale = 2
+        self.layout_scale = self.render_scale
         self.fixed_decimal_places = fixed_decimal_places
         self.extension = file_extension(document["name"])
         self.tot_pages = 1
+        self.collected_tables = None
+        self.checkpoints = checkpoints
+        self.page_cache = page_cache
+        self.textract_jobs = None
+
+        # Either a file path or its contents. The PDF backends read a path
+        # directly from disk, so the file is never fully loaded in memory
+        source = document.get("path") or document["content"]
 
         if self.extension == "pdf":
-            self.pdf = pymupdf.open("pdf", document["content"])
+            # Tables from the PDF text layer need PyMuPDF, other methods only
+            # render pages. The PDF is parsed once by the chosen backend
+            self.pdf = open_pdf(
+                source, "pymupdf" if method == "pdf-text" else pdf_backend
+            )
             self.tot_pages = self.pdf.page_count
+            # Only surya tables are rendered again at full resolution, other
+            # methods read the whole page
+            if layout_scale and method == "surya+paddle":
+                self.layout_scale = layout_scale
 
         self.set_page_nums(document["pages"])
-        self.load_pages(document["content"], method)
+        if checkpoints:
+            self.page_nums -= checkpoints.done_pages()
+        self.load_pages(source, method, read_ahead)
 
         self.workbook = Workbook()
         self.workbook.remove(self.workbook.active)
@@ -39,21 +67,154 @@ class Document:
         for start, end in page_ranges:
             self.page_nums |= set(range(start, min(self.tot_pages, end) + 1))
 
-    def load_pages(self, document, method):
-        if self.extension == "pdf":
+    def load_pages(self, document, method, read_ahead=0):
+        if method == "textract-async":
+            # Textract reads the document itself, pages are never rendered
+            render_page = lambda _: None
+        elif self.extension == "pdf":
             if method == "pdf-text":
-                self.pages = {i: self.pdf.load_page(i - 1) for i in self.page_nums}
+                render_page = self.pdf.text_page
             else:
-                pdf = pypdfium2.PdfDocument(BytesIO(document))
-                self.pages = dict(
-                    zip(
-                        self.page_nums,
-                        pdf.render(
-                            pypdfium2.PdfBitmap.to_pil,
-                            page_indices=[i - 1 for i in self.page_nums],
-                            scale=2,
-                        ),
-                    )
-                )
+                render_page = self.render_page
         else:
-            self.pages = {1: Image.open(BytesIO(document))}
+            image = document if isinstance(document, str) else BytesIO(document)
+            render_page = lambda _: Image.open(image)
+
+        self.load_page = render_page
+        self.pages = PageSource(render_page, sorted(self.page_nums), read_ahead)
+
+    @property
+    def two_pass(self):
+        return self.layout_scale != self.render_scale
+
+    def render_page(self, page_num):
+        return self.pdf.render(page_num, self.layout_scale)
+
+    def render_region(self, page_num, bbox):
+        # bbox is in pixels of the page rendered at layout_scale
+        clip = [c / self.layout_scale for c in bbox]
+        return self.pdf.render(page_num, self.render_scale, clip)
+
+    def add_table(self, page_num, table_num, table_matrix, footer_text):
+        if self.collected_tables is not None:
+            # Page workers and the pipeline hand their tables to another
+            # stage, which passes them to add_page_tables
+            self.collected_tables.append(
+                (page_num, table_num, table_matrix, footer_text)
+            )
+            return
+
+        if self.checkpoints:
+            # Written to the workbook from the checkpoints once all pages are done
+            self.checkpoints.add_table(page_num, table_num, table_matrix, footer_text)
+            return
+
+        self.write_table(page_num, table_num, table_matrix, footer_text)
+
+    def add_page_tables(self, page_nums, tables):
+        # All the tables of these pages, collected by another stage
+        for table in tables:
+            if self.checkpoints:
+                self.checkpoints.add_table(*table)
+            else:
+                self.write_table(*table)
+
+        if self.checkpoints:
+            for page_num in page_nums:
+                self.checkpoints.save_page(page_num)
+
+    def write_table(self, page_num, table_num, table_matrix, footer_text):
+        thin_white_border = Border(
+            left=Side(style="thin", color="FFFFFF"),
+            right=Side(style="thin", color="FFFFFF"),
+            top=Side(style="thin", color="FFFFFF"),
+            bottom=Side(style="thin", color="FFFFFF"),
+        )
+        thick_blue_border = Border(
+            left=Side(style="thick", color="0000FF"),
+            right=Side(style="thick", color="0000FF"),
+            top=Side(style="thick", color="0000FF"),
+            bottom=Side(style="thick", color="0000FF"),
+        )
+        thick_violet_border = Border(
+            left=Side(style="thick", color="FF00FF"),
+            right=Side(style="thick", color="FF00FF"),
+            top=Side(style="thick", color="FF00FF"),
+            bottom=Side(style="thick", color="FF00FF"),
+        )
+
+        self.footers_workbook.active.append(
+            [
+                page_num,
+                table_num,
+                footer_text,
+            ]
+        )
+
+        sheet_name = f"page_{page_num}_table_{table_num}"
+        sheet = self.workbook.create_sheet(sheet_name)
+
+        for i, row in enumerate(table_matrix, 1):
+            for j, col in enumerate(row, 1):
+                cell = sheet.cell(row=i, column=j, value=col["text"])
+                cell_color = get_cell_color(col["confidence"])
+                if cell_color:
+                    cell.fill = PatternFill(start_color=cell_color, fill_type="solid")
+                    cell.border = [
+                        thin_white_border,
+                        thick_violet_border,
+                        thick_blue_border,
+                    ][col["cnt_numbers"]]
+
+                    if col["footnotes"]:
+                        cell.comment = Comment(",".join(col["footnotes"]), "automatic")
+
+
+class PageSource:
+    # Renders pages in order only when they are needed. With read_ahead, a
+    # background thread keeps up to that many next pages already rendered
+    def __init__(self, render_page, page_nums, read_ahead=0):
+        self.render_page = render_page
+        self.page_nums = page_nums
+        self.read_ahead = read_ahead
+
+    def __len__(self):
+        return len(self.page_nums)
+
+    def __iter__(self):
+        if not self.read_ahead:
+            for page_num in self.page_nums:
+                yield page_num, self.render_page(page_num)
+            return
+
+        rendered = queue.Queue(maxsize=self.read_ahead)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    rendered.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def produce():
+            try:
+                for page_num in self.page_nums:
+                    # The pages are no longer read, e.g. after an error
+                    if stop.is_set():
+                        return
+                    put((page_num, self.render_page(page_num)))
+            except Exception as e:
+                put(e)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            for _ in self.page_nums:
+                item = rendered.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
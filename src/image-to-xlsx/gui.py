@@ -53,7 +53,8 @@ def extract_tables(
                     "table_workbook": table_workbook,
                     "footers_workbook": footers_workbook,
                     "name": file["name"],
-                    "input_content": file["content"],
+                    "input_path": file.get("path"),
+                    "input_content": file.get("content"),
                 }
             )
         except (
@@ -98,10 +99,11 @@ def create_results_zip(results, options):
                 workbook_to_bytes(result["footers_workbook"]),
             )
             if options.get("include_input_files_in_output"):
-                zipf.writestr(
-                    (output_base / relative_name.name).as_posix(),
-                    result["input_content"],
-                )
+                input_name = (output_base / relative_name.name).as_posix()
+                if result["input_path"]:
+                    zipf.write(result["input_path"], input_name)
+                else:
+                    zipf.writestr(input_name, result["input_content"])
     buffer.seek(0)
     return buffer.read()
 
@@ -186,13 +188,13 @@ if __name__ == "__main__":
             options,
             cancel_event,
         )
-        
+
         # Update module-level results_zip
         import sys
         current_module = sys.modules[__name__]
         current_module.results_zip = extraction_result["results_zip"]
         results_zip = extraction_result["results_zip"]
-        
+
         extract_button.enabled = True
         stop_button.enabled = False
         in_progress = False
@@ -640,14 +642,16 @@ if ($result -eq "OK") { $d.FileNames -join "`n" }
             if file_name in uploaded_files:
                 continue
 
-            with real_path.open("rb") as f:
-                uploaded_files[file_name] = {
-                    "name": file_name,
-                    "content": f.read(),
-                    "type": "application/pdf"
+            # Local files are read from disk when processed, not kept in memory
+            uploaded_files[file_name] = {
+                "name": file_name,
+                "path": str(real_path),
+                "type": (
+                    "application/pdf"
                     if real_path.suffix.lower() == ".pdf"
-                    else "image/*",
-                }
+                    else "image/*"
+                ),
+            }
             uploaded_files_pages[file_name] = [(1, INF)]
             add_to_uploaded_files_list(file_name, uploaded_files[file_name]["type"])
             added_count += 1
@@ -703,12 +707,11 @@ if ($result -eq "OK") { $d.FileNames -join "`n" }
         file_type = (
             "application/pdf" if file_path.suffix.lower() == ".pdf" else "image/*"
         )
-        with file_path.open("rb") as f:
-            uploaded_files[file_name] = {
-                "name": file_name,
-                "content": f.read(),
-                "type": file_type,
-            }
+        uploaded_files[file_name] = {
+            "name": file_name,
+            "path": str(file_path),
+            "type": file_type,
+        }
         uploaded_files_pages[file_name] = [(1, INF)]
         add_to_uploaded_files_list(file_name, file_type)
 
@@ -1,9 +1,18 @@
 from document import Document
-from page import Page
+from page import Page, batch_detect_tables
+from table import batch_recognize_structure
+from ocr import OcrQueue
 from cli import parse_args
-from utils import get_document_paths, save_workbook
-from definitions import INF
+from utils import get_document_paths, save_workbook, batched
+from definitions import INF, PAGE_CACHE_PATH
+import pretrained
 import shutil
+from pathlib import Path
+from daemon import daemon_running, submit_job
+from pipeline import run_pipeline, print_metrics
+from checkpoint import PageCheckpoints
+from cache import DiskCache
+from manifest import Manifest, OUTPUT_OPTIONS
 
 
 class ProcessingCancelled(Exception):
@@ -21,6 +30,7 @@ def run(
     show_detected_boxes=0,
     compute_prefix=INF,
     image_pad=100,
+    image_pad_ratio=0,
     fixed_decimal_places=0,
     extend_rows=0,
     heuristic_thresh=0.6,
@@ -29,45 +39,303 @@ def run(
     decimal_separator=".",
     thousands_separator=",",
     fix_num_misspellings=1,
+    page_batch_size=8,
+    structure_batch_size=None,
+    ocr_batch_size=64,
+    ocr_max_batch_mb=256,
+    engine="torch",
+    read_ahead=0,
+    layout_scale=0,
+    pdf_backend="pdfium",
+    workers=1,
+    pipeline_depth=0,
+    checkpoint_dir=None,
+    page_cache=1,
+    page_cache_max_mb=1024,
+    textract_concurrency=1,
+    textract_tps=5,
+    textract_endpoint_url=None,
+    textract_s3_bucket=None,
+    textract_async_chunk_pages=100,
+    textract_poll_interval=5,
+    textract_cache=1,
+    textract_cache_max_mb=1024,
+    textract_offline=0,
     stop_event=None,
     **kwargs,
 ):
-    d = Document(
+    # Rotating a low resolution page would not match the table re-renders
+    layout_scale = 0 if unskew else layout_scale
+    page_options = dict(
+        unskew=unskew,
+        binarize=binarize,
+        extend_rows=extend_rows,
+        nlp_postprocess=nlp_postprocess,
+        nlp_postprocess_prompt_file=nlp_postprocess_prompt_file,
+        text_language=text_language,
+        show_detected_boxes=show_detected_boxes,
+        compute_prefix=compute_prefix,
+        image_pad=image_pad,
+        image_pad_ratio=image_pad_ratio,
+        heuristic_thresh=heuristic_thresh,
+        textract_response_pickle_file=textract_response_pickle_file,
+        remove_dots_and_commas=remove_dots_and_commas,
+        decimal_separator=decimal_separator,
+        thousands_separator=thousands_separator,
+        fix_num_misspellings=fix_num_misspellings,
+        structure_batch_size=structure_batch_size,
+        ocr_batch_size=ocr_batch_size,
+        ocr_max_batch_mb=ocr_max_batch_mb,
+        textract_concurrency=textract_concurrency,
+        textract_tps=textract_tps,
+        textract_endpoint_url=textract_endpoint_url,
+        textract_cache=textract_cache,
+        textract_cache_max_mb=textract_cache_max_mb,
+        textract_offline=textract_offline,
+    )
+
+    checkpoints = None
+    if checkpoint_dir:
+        # Pages finished by an earlier run with the same file and options
+        # are not processed again
+        # Options that only change the speed, like batch sizes, can change
+        # when resuming, e.g. after running out of memory
+        output_options = {
+            option: value
+            for option, value in dict(
+                page_options,
+                method=method,
+                fixed_decimal_places=fixed_decimal_places,
+                layout_scale=layout_scale,
+                pdf_backend=pdf_backend,
+                engine=engine,
+            ).items()
+            if option in OUTPUT_OPTIONS
+        }
+        checkpoints = PageCheckpoints(checkpoint_dir, document, output_options)
+
+    document_args = (
         document,
         fixed_decimal_places,
         method,
+        read_ahead,
+        layout_scale,
+        pdf_backend,
+        checkpoints,
+        DiskCache(PAGE_CACHE_PATH, page_cache_max_mb) if page_cache else None,
     )
+    d = Document(*document_args)
 
-    for i, page in sorted(d.pages.items()):
-        if stop_event and stop_event.is_set():
-            raise ProcessingCancelled("Processing was stopped by user request")
-        print(f"    Processing page {i}")
-        p = Page(page, i, d)
-        p.process_page(
-            unskew=unskew,
-            binarize=binarize,
-            extend_rows=extend_rows,
-            nlp_postprocess=nlp_postprocess,
-            nlp_postprocess_prompt_file=nlp_postprocess_prompt_file,
-            text_language=text_language,
-            show_detected_boxes=show_detected_boxes,
-            compute_prefix=compute_prefix,
-            image_pad=image_pad,
-            heuristic_thresh=heuristic_thresh,
-            textract_response_pickle_file=textract_response_pickle_file,
-            remove_dots_and_commas=remove_dots_and_commas,
-            decimal_separator=decimal_separator,
-            thousands_separator=thousands_separator,
-            fix_num_misspellings=fix_num_misspellings,
-            stop_event=stop_event,
+    if method == "textract-async":
+        from textract import AsyncTextractJobs
+
+        if not textract_s3_bucket:
+            raise ValueError("The textract-async method needs an S3 bucket")
+        d.textract_jobs = AsyncTextractJobs(
+            document,
+            d.pages.page_nums,
+            textract_s3_bucket,
+            textract_endpoint_url,
+            textract_async_chunk_pages,
+            textract_tps,
+            textract_poll_interval,
         )
 
-        if stop_event and stop_event.is_set():
-            raise ProcessingCancelled("Processing was stopped by user request")
+    try:
+        # Page workers would each start their own Textract jobs
+        if workers > 1 and len(d.pages) > 1 and method != "textract-async":
+            run_page_workers(
+                d,
+                document_args,
+                engine,
+                page_options,
+                page_batch_size,
+                workers,
+                stop_event,
+            )
+        elif pipeline_depth:
+            if method == "surya+paddle":
+                pretrained.set_engine(engine)
+            run_pipelined(d, page_batch_size, pipeline_depth, stop_event, page_options)
+        else:
+            if method == "surya+paddle":
+                pretrained.set_engine(engine)
+            pages = (Page(page, i, d) for i, page in d.pages)
+            for batch in batched(pages, page_batch_size):
+                process_page_batch(batch, stop_event, **page_options)
+    finally:
+        # Documents uploaded for Textract are not left in the bucket
+        if d.textract_jobs:
+            d.textract_jobs.close()
+
+    check_cancelled(stop_event)
+    if checkpoints:
+        checkpoints.write_to(d)
 
     return d.workbook, d.footers_workbook
 
 
+def process_page_batch(pages, stop_event=None, **kwargs):
+    check_cancelled(stop_event)
+
+    # Pages found in the page cache skip detection and OCR
+    uncached = [p for p in pages if not p.load_cached_tables(**kwargs)]
+
+    method = pages[0].document.method
+    if uncached and method == "textract" and kwargs.get("textract_concurrency") > 1:
+        from textract import fetch_responses, response_cache
+
+        print(f"    Sending pages {uncached[0].page_num}-{uncached[-1].page_num}")
+        fetch_responses(
+            uncached,
+            kwargs.get("textract_concurrency"),
+            kwargs.get("textract_tps"),
+            kwargs.get("textract_endpoint_url"),
+            response_cache(
+                kwargs.get("textract_cache"),
+                kwargs.get("textract_cache_max_mb"),
+                kwargs.get("textract_offline"),
+            ),
+            unskew=kwargs.get("unskew"),
+            binarize=kwargs.get("binarize"),
+        )
+
+    if uncached and method == "surya+paddle":
+        ocr_queue = OcrQueue(
+            pretrained.get("ocr_pipeline"),
+            kwargs.get("ocr_batch_size"),
+            kwargs.get("ocr_max_batch_mb"),
+            stop_event,
+        )
+        prepare_surya_paddle_pages(uncached, ocr_queue, stop_event=stop_event, **kwargs)
+
+    for p in pages:
+        check_cancelled(stop_event)
+        print(f"    Processing page {p.page_num}")
+        p.process_page(stop_event=stop_event, **kwargs)
+        p.release()
+
+        check_cancelled(stop_event)
+        # Collected tables are saved by the stage they are handed to
+        if p.document.checkpoints and p.document.collected_tables is None:
+            p.document.checkpoints.save_page(p.page_num)
+
+
+def run_pipelined(d, page_batch_size, pipeline_depth, stop_event, page_options):
+    # Pages are rendered and preprocessed ahead in one thread and the tables
+    # written to the workbook in another, while this thread runs inference
+    def preprocessed_pages():
+        # Pages of other methods are not unskewed or binarized
+        preprocess = d.method in ("surya+paddle", "textract")
+        for i, page in d.pages:
+            p = Page(page, i, d)
+            if not p.load_cached_tables(**page_options) and preprocess:
+                p.preprocess(page_options["unskew"], page_options["binarize"])
+            yield p
+
+    def process(batch):
+        d.collected_tables = []
+        process_page_batch(batch, stop_event, **page_options)
+        return [p.page_num for p in batch], d.collected_tables
+
+    def write(result):
+        # Also writes the checkpoints of the pages, when they are on
+        d.add_page_tables(*result)
+
+    metrics = run_pipeline(
+        preprocessed_pages(), process, write, page_batch_size, pipeline_depth
+    )
+    d.collected_tables = None
+    check_cancelled(stop_event)
+    print_metrics(metrics)
+
+
+# Set in each page worker process by init_page_worker
+worker_document = None
+worker_page_options = None
+
+
+def init_page_worker(document_args, engine, page_options, threads):
+    global worker_document, worker_page_options
+    worker_document = Document(*document_args)
+    worker_page_options = page_options
+
+    if worker_document.method == "surya+paddle":
+        import torch
+
+        # Workers share the cores instead of each using all of them
+        torch.set_num_threads(threads)
+        pretrained.set_engine(engine)
+        pretrained.warm_up()
+
+
+def process_pages_in_worker(page_nums):
+    d = worker_document
+    d.collected_tables = []
+    pages = [Page(d.load_page(i), i, d) for i in page_nums]
+    process_page_batch(pages, **worker_page_options)
+    return d.collected_tables
+
+
+def run_page_workers(
+    d, document_args, engine, page_options, page_batch_size, workers, stop_event
+):
+    # Each worker opens the document and loads the models once, then renders
+    # and processes whole page batches. Tables are added back in page order
+    import multiprocessing
+    import os
+
+    page_nums = d.pages.page_nums
+    workers = min(workers, len(page_nums))
+    batch_size = min(page_batch_size, -(-len(page_nums) // workers))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    pool = multiprocessing.get_context("spawn").Pool(
+        workers,
+        init_page_worker,
+        (document_args, engine, page_options, threads),
+    )
+    try:
+        batches = list(batched(page_nums, batch_size))
+        results = [
+            pool.apply_async(process_pages_in_worker, (batch,)) for batch in batches
+        ]
+        for batch, result in zip(batches, results):
+            while not result.ready():
+                check_cancelled(stop_event)
+                result.wait(0.1)
+            d.add_page_tables(batch, result.get())
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    check_cancelled(stop_event)
+
+
+def prepare_surya_paddle_pages(pages, ocr_queue, **kwargs):
+    # Batched stages shared by all pages, Page.process_page reuses their results
+    for p in pages:
+        p.preprocess(kwargs.get("unskew"), kwargs.get("binarize"))
+
+    print(f"    Detecting tables in pages {pages[0].page_num}-{pages[-1].page_num}")
+    batch_detect_tables(pages)
+    batch_recognize_structure(
+        [t for p in pages for t in p.create_surya_tables()],
+        kwargs.get("heuristic_thresh"),
+        kwargs.get("structure_batch_size"),
+    )
+
+    for p in pages:
+        p.enqueue_texts(ocr_queue, **kwargs)
+    ocr_queue.flush()
+
+
+def check_cancelled(stop_event):
+    if stop_event and stop_event.is_set():
+        raise ProcessingCancelled("Processing was stopped by user request")
+
+
 def save_output(table_workbook, footers_workbook, output_dir, file_name, source_path):
     output_dir.mkdir(parents=True, exist_ok=True)
     output_xlsx_path = output_dir / f"{file_name}.xlsx"
@@ -77,34 +345,190 @@ def save_output(table_workbook, footers_workbook, output_dir, file_name, source_
     save_workbook(footers_workbook, footers_xlsx_path)
 
 
+def process_document(source_path, output_dir, name, options):
+    document = {
+        "name": name,
+        "path": str(source_path),
+        "pages": [(options["first_page"], options["last_page"])],
+    }
+    checkpoint_dir = None
+    if options.get("checkpoints"):
+        checkpoint_dir = output_dir.parent / ".checkpoints" / output_dir.name
+
+    table_workbook, footers_workbook = run(
+        document, checkpoint_dir=checkpoint_dir, **options
+    )
+    save_output(
+        table_workbook,
+        footers_workbook,
+        output_dir,
+        Path(name).stem,
+        source_path,
+    )
+
+    if checkpoint_dir:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        try:
+            checkpoint_dir.parent.rmdir()
+        except OSError:
+            pass
+
+
+# Set in each document worker process by init_document_worker
+worker_options = None
+
+
+def init_document_worker(options, threads):
+    global worker_options
+    worker_options = options
+
+    if options["method"] == "surya+paddle":
+        import torch
+
+        torch.set_num_threads(threads)
+        pretrained.set_engine(options["engine"])
+        pretrained.warm_up()
+
+
+def process_document_in_worker(job):
+    import time
+
+    source_path, output_dir, name = job
+    start = time.perf_counter()
+    error = None
+    try:
+        process_document(source_path, output_dir, name, worker_options)
+        print(f"Finished document {name}")
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"Failed document {name}: {error}")
+
+    return name, source_path.stat().st_size, time.perf_counter() - start, error
+
+
+def process_documents_in_parallel(jobs, options, workers, on_finished=None):
+    # Largest documents first, so no long document starts when the rest of
+    # the pool is about to go idle. Workers take the next one when they finish.
+    # A worker that dies, e.g. killed when out of memory, breaks the pool: the
+    # documents lost with it are retried once in a new pool, then reported
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+    import multiprocessing
+    import os
+    import time
+
+    if not jobs:
+        return
+
+    jobs = sorted(jobs, key=lambda job: job[0].stat().st_size, reverse=True)
+    workers = min(workers, len(jobs))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # Worker processes cannot start page workers of their own
+    options = {**options, "workers": 1}
+
+    start = time.perf_counter()
+    results = []
+    retried = set()
+    pending = jobs
+    while pending:
+        lost = []
+        with ProcessPoolExecutor(
+            min(workers, len(pending)),
+            multiprocessing.get_context("spawn"),
+            init_document_worker,
+            (options, threads),
+        ) as pool:
+            futures = {
+                pool.submit(process_document_in_worker, job): job for job in pending
+            }
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    lost.append(job)
+                    continue
+                results.append(result)
+                if on_finished and not result[3]:
+                    on_finished(*job)
+
+        pending = []
+        for job in lost:
+            source_path, _, name = job
+            if name in retried:
+                error = "BrokenProcessPool: the worker process died"
+                results.append((name, source_path.stat().st_size, 0, error))
+                print(f"Failed document {name}: {error}")
+            else:
+                retried.add(name)
+                pending.append(job)
+
+    elapsed = time.perf_counter() - start
+
+    failed = [(name, error) for name, _, _, error in results if error]
+    total_mb = sum(size for _, size, _, _ in results) / 2**20
+    print(
+        f"Processed {len(results) - len(failed)} of {len(results)} documents "
+        f"({total_mb:.1f} MB) in {elapsed:.1f}s with {workers} workers: "
+        f"{60 * len(results) / elapsed:.1f} documents/min, "
+        f"{total_mb / elapsed:.2f} MB/s"
+    )
+    for name, error in failed:
+        print(f"    Failed {name}: {error}")
+
+
 if __name__ == "__main__":
     args = parse_args()
 
     root_dir_path, relative_paths = get_document_paths(args.input_path)
+    use_daemon = args.use_daemon and daemon_running(args.daemon_socket)
+    parallel = not use_daemon and args.document_workers > 1
 
     if not relative_paths:
         print("No supported files found to process")
+    elif use_daemon:
+        print(f"Sending documents to daemon on {args.daemon_socket}")
+    elif args.method == "surya+paddle" and not parallel:
+        # Models stay loaded in the registry and are shared by all documents.
+        # Page workers load their own, the models of single page documents
+        # are loaded when first used
+        pretrained.set_engine(args.engine)
+        if args.workers <= 1:
+            pretrained.warm_up()
+
+    # Only new or changed documents, or those processed with other options,
+    # are processed again
+    manifest = Manifest(root_dir_path / "results", vars(args))
 
+    jobs = []
     for relative_path in relative_paths:
-        print(f"Processing document {relative_path}")
         source_path = root_dir_path / relative_path
         output_dir = (root_dir_path / "results" / relative_path).parent / relative_path.stem
 
-        if not args.overwrite_existing_result and output_dir.is_dir():
-            print("Skipping already processed document")
+        if not args.overwrite_existing_result and manifest.is_up_to_date(
+            str(relative_path), source_path, output_dir
+        ):
+            print(f"Skipping already processed document {relative_path}")
             continue
 
-        with source_path.open("rb") as f:
-            document = {
-                "name": str(relative_path),
-                "content": f.read(),
-                "pages": [(args.first_page, args.last_page)],
-            }
-            table_workbook, footers_workbook = run(document, **vars(args))
-            save_output(
-                table_workbook,
-                footers_workbook,
-                output_dir,
-                relative_path.stem,
-                source_path,
-            )
+        jobs.append((source_path, output_dir, str(relative_path)))
+
+    if parallel:
+        process_documents_in_parallel(
+            jobs,
+            vars(args),
+            args.document_workers,
+            lambda source_path, output_dir, name: manifest.record(
+                name, source_path, output_dir
+            ),
+        )
+    else:
+        for source_path, output_dir, name in jobs:
+            print(f"Processing document {name}")
+            if use_daemon:
+                submit_job(
+                    source_path, output_dir, name, vars(args), args.daemon_socket
+                )
+            else:
+                process_document(source_path, output_dir, name, vars(args))
+            manifest.record(name, source_path, output_dir)
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import shutil
+from pathlib import Path
+from checkpoint import options_hash
+
+MANIFEST_NAME = "manifest.json"
+# Options that change the output files, e.g. --workers does not
+OUTPUT_OPTIONS = {
+    "method",
+    "first_page",
+    "last_page",
+    "binarize",
+    "unskew",
+    "nlp_postprocess",
+    "nlp_postprocess_prompt_file",
+    "text_language",
+    "show_detected_boxes",
+    "extend_rows",
+    "image_pad",
+    "image_pad_ratio",
+    "compute_prefix",
+    "heuristic_thresh",
+    "engine",
+    "layout_scale",
+    "pdf_backend",
+    "fixed_decimal_places",
+    "textract_response_pickle_file",
+    "textract_endpoint_url",
+    "remove_dots_and_commas",
+    "fix_num_misspellings",
+    "decimal_separator",
+    "thousands_separator",
+}
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def output_names(source_path):
+    source_path = Path(source_path)
+    return [
+        f"{source_path.stem}.xlsx",
+        f"footers_{source_path.stem}.xlsx",
+        source_path.name,
+    ]
+
+
+class Manifest:
+    # Records the size, mtime, content hash and output options of each
+    # processed document, keyed by its path relative to the input directory.
+    # Files are only hashed when their size or mtime changed, or when a new
+    # path may be a processed document that was moved
+    def __init__(self, results_dir, options):
+        self.results_dir = Path(results_dir)
+        self.source_dir = self.results_dir.parent
+        self.path = self.results_dir / MANIFEST_NAME
+        self.options = options_hash(
+            {k: v for k, v in options.items() if k in OUTPUT_OPTIONS}
+        )
+        self.entries = {}
+        if self.path.is_file():
+            self.entries = json.loads(self.path.read_text())
+
+    def is_up_to_date(self, name, source_path, output_dir):
+        entry = self.entries.get(name) or self.find_moved(name, source_path, output_dir)
+        if entry is None and output_dir.is_dir():
+            # Processed before there was a manifest
+            self.record(name, source_path, output_dir)
+            return True
+        if entry is None:
+            return False
+
+        if entry["options"] != self.options or not all(
+            (self.results_dir / output).is_file() for output in entry["outputs"]
+        ):
+            return False
+
+        stat = source_path.stat()
+        if (entry["size"], entry["mtime"]) == (stat.st_size, stat.st_mtime):
+            return True
+
+        if stat.st_size != entry["size"] or file_sha256(source_path) != entry["sha256"]:
+            return False
+
+        # Touched but not changed
+        entry["mtime"] = stat.st_mtime
+        self.save()
+        return True
+
+    def find_moved(self, name, source_path, output_dir):
+        size = source_path.stat().st_size
+        sha256 = None
+        for old_name, entry in list(self.entries.items()):
+            if entry["size"] != size or (self.source_dir / old_name).exists():
+                continue
+
+            sha256 = sha256 or file_sha256(source_path)
+            if entry["sha256"] == sha256:
+                print(f"Moving results of {old_name} to {name}")
+                self.move_outputs(old_name, name, output_dir)
+                return self.entries[name]
+
+        return None
+
+    def move_outputs(self, old_name, name, output_dir):
+        entry = self.entries.pop(old_name)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        outputs = []
+        for output, new_name in zip(entry["outputs"], output_names(name)):
+            new_path = output_dir / new_name
+            shutil.move(self.results_dir / output, new_path)
+            outputs.append(new_path.relative_to(self.results_dir).as_posix())
+
+        old_output_dir = (self.results_dir / entry["outputs"][0]).parent
+        if old_output_dir.is_dir() and not any(old_output_dir.iterdir()):
+            old_output_dir.rmdir()
+
+        entry["outputs"] = outputs
+        entry["mtime"] = (self.source_dir / name).stat().st_mtime
+        self.entries[name] = entry
+        self.save()
+
+    def record(self, name, source_path, output_dir):
+        stat = source_path.stat()
+        self.entries[name] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": file_sha256(source_path),
+            "options": self.options,
+            "outputs": [
+                (output_dir / output).relative_to(self.results_dir).as_posix()
+                for output in output_names(name)
+            ],
+        }
+        self.save()
+
+    def save(self):
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.entries, indent=2))
+        tmp_path.replace(self.path)
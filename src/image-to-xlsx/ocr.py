@@ -0,0 +1,48 @@
+import numpy as np
+
+
+class OcrQueue:
+    def __init__(self, pipeline, batch_size=64, max_batch_mb=256, stop_event=None):
+        self.pipeline = pipeline
+        self.batch_size = max(1, batch_size)
+        self.max_batch_bytes = max_batch_mb * 1024 * 1024
+        self.stop_event = stop_event
+        self.pending = []
+        self.pending_bytes = 0
+
+    def put(self, table, cell, image_pad, show_cropped_bboxes=False):
+        # Only the cell reference is queued, the padded crop is built on flush
+        shape = table.get_cropped_cell_shape(cell, image_pad)
+        crop_bytes = int(np.prod(shape))
+
+        if self.pending and self.pending_bytes + crop_bytes > self.max_batch_bytes:
+            self.flush()
+
+        self.pending.append((table, cell, image_pad, show_cropped_bboxes, shape))
+        self.pending_bytes += crop_bytes
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        batch_bytes, self.pending_bytes = self.pending_bytes, 0
+        if not pending or (self.stop_event and self.stop_event.is_set()):
+            return
+
+        # One white buffer for the whole batch, each crop is a view into it
+        buffer = np.full(batch_bytes, 255, dtype=np.uint8)
+        cropped_imgs = []
+        offset = 0
+        for table, cell, image_pad, show_cropped_bboxes, shape in pending:
+            size = int(np.prod(shape))
+            out = buffer[offset : offset + size].reshape(shape)
+            cropped_imgs.append(
+                table.get_cropped_cell_image(cell, image_pad, show_cropped_bboxes, out)
+            )
+            offset += size
+
+        output = self.pipeline.predict(cropped_imgs)
+
+        for (table, cell, *_), pred in zip(pending, output):
+            table.add_cell_text(cell, pred)
@@ -0,0 +1,142 @@
+import copy
+import hashlib
+import json
+import numpy as np
+import onnxruntime
+import torch
+from pathlib import Path
+from types import SimpleNamespace
+from definitions import ONNX_CACHE_PATH
+
+
+class LogitsOutput(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits
+
+
+class LastHiddenStateOutput(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).last_hidden_state
+
+
+def cached_onnx_path(name, module, dummy_input, output_name, quantize):
+    cache_dir = Path(ONNX_CACHE_PATH)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    onnx_path = cache_dir / f"{name}.onnx"
+    int8_path = cache_dir / f"{name}.int8.onnx"
+
+    if not onnx_path.is_file():
+        print(f"Exporting {name} to ONNX, this is only done once")
+        tmp_path = onnx_path.with_suffix(".tmp")
+        with torch.inference_mode():
+            torch.onnx.export(
+                module,
+                (dummy_input,),
+                str(tmp_path),
+                input_names=["pixel_values"],
+                output_names=[output_name],
+                dynamic_axes={"pixel_values": {0: "batch"}, output_name: {0: "batch"}},
+                opset_version=17,
+            )
+        tmp_path.replace(onnx_path)
+
+    if quantize and not int8_path.is_file():
+        # Needs the onnx package, which plain ONNX Runtime inference does not
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        tmp_path = int8_path.with_suffix(".tmp")
+        quantize_dynamic(str(onnx_path), str(tmp_path), weight_type=QuantType.QInt8)
+        tmp_path.replace(int8_path)
+
+    return int8_path if quantize else onnx_path
+
+
+def cache_name(model):
+    # Exported again when surya ships new weights or a new config
+    h = hashlib.sha256(json.dumps(model.config.to_dict(), default=str).encode())
+    for key, tensor in model.state_dict().items():
+        h.update(key.encode())
+        h.update(tensor.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy())
+    return f"{model.config.name_or_path.replace('/', '_')}_{h.hexdigest()[:16]}"
+
+
+def inference_session(path):
+    return onnxruntime.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+
+
+def run_session(session, pixel_values):
+    [output] = session.run(
+        None, {"pixel_values": pixel_values.cpu().numpy().astype(np.float32)}
+    )
+    return torch.from_numpy(output)
+
+
+class OnnxDetectionModel:
+    # Drop-in for the surya detection/layout models used by batch_detection
+    def __init__(self, model, processor, quantize=False):
+        self.config = model.config
+        self.dtype = torch.float32
+        self.device = torch.device("cpu")
+        dummy_input = torch.zeros(
+            1, 3, processor.size["height"], processor.size["width"]
+        )
+        self.session = inference_session(
+            cached_onnx_path(
+                cache_name(model),
+                # A float copy, so the torch model given is left untouched
+                LogitsOutput(copy.deepcopy(model).float().cpu()),
+                dummy_input,
+                "logits",
+                quantize,
+            )
+        )
+
+    def __call__(self, pixel_values):
+        return SimpleNamespace(logits=run_session(self.session, pixel_values))
+
+
+class OnnxEncoder(torch.nn.Module):
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    # The encoder-decoder forward also passes output_attentions, return_dict...
+    def forward(self, pixel_values=None, **kwargs):
+        return SimpleNamespace(
+            last_hidden_state=run_session(self.session, pixel_values)
+        )
+
+
+def onnx_table_rec_model(model, quantize=False):
+    # The autoregressive decoder keeps its torch KV cache, so only the image
+    # encoder runs in ONNX Runtime and the decoders get int8 Linear layers
+    width, height = model.config.encoder.image_size
+    # The encoder is replaced and the decoders quantized in place, on a copy
+    model = copy.deepcopy(model).float().cpu()
+    model.encoder = OnnxEncoder(
+        inference_session(
+            cached_onnx_path(
+                f"{cache_name(model)}_encoder",
+                LastHiddenStateOutput(model.encoder),
+                torch.zeros(1, 3, height, width),
+                "last_hidden_state",
+                quantize,
+            )
+        )
+    )
+
+    if quantize:
+        for module in [model.decoder, model.text_encoder]:
+            torch.ao.quantization.quantize_dynamic(
+                module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+
+    return model
@@ -1,17 +1,32 @@
 import numpy as np
 import pretrained
 import pickle
-import io
-import boto3
 import time
+import json
+from cache import hash_key
 from definitions import MAX_TEXTRACT_SYNC_SIZE, ONE_MB
-from table import Table
-from unskewing import correct_skew
-from binarization import binarize
+from table import Table, batch_recognize_structure
+from textract_blocks import TextractBlocks
+from ocr import OcrQueue
 from PIL import Image
-from surya.detection import batch_text_detection
-from surya.layout import batch_layout_detection
-from utils import image_below_size, maybe_reduce_resolution, get_aws_credentials
+from utils import (
+    jpeg_below_size,
+    maybe_reduce_resolution,
+    to_json,
+)
+
+CACHED_METHODS = {"surya+paddle", "textract"}
+# Options that change the raw table data. Post-processing options do not
+CACHED_STAGE_OPTIONS = [
+    "unskew",
+    "binarize",
+    "image_pad",
+    "image_pad_ratio",
+    "compute_prefix",
+    "heuristic_thresh",
+    # Tables of a local Textract stand-in are not reused for AWS
+    "textract_endpoint_url",
+]
 
 
 class Page:
@@ -31,6 +46,13 @@ class Page:
         self.layout_model = None
         self.layout_processor = None
         self.ocr_pipeline = None
+        self.preprocessed = False
+        self.binarized = False
+        self.table_bboxes = None
+        self.tables = None
+        self.cache_key = None
+        self.cached_tables = None
+        self.textract_response = None
 
     def set_models(
         self,
@@ -42,33 +64,46 @@ class Page:
         layout_processor=None,
         ocr_pipeline=None,
     ):
-        self.model = model or pretrained.model()
-        self.processor = processor or pretrained.processor()
-        self.det_model = det_model or pretrained.det_model()
-        self.det_processor = det_processor or pretrained.det_processor()
-        self.layout_model = layout_model or pretrained.layout_model()
-        self.layout_processor = layout_processor or pretrained.layout_processor()
-        self.ocr_pipeline = ocr_pipeline or pretrained.ocr_pipeline()
+        self.model = model or pretrained.get("model")
+        self.processor = processor or pretrained.get("processor")
+        self.det_model = det_model or pretrained.get("det_model")
+        self.det_processor = det_processor or pretrained.get("det_processor")
+        self.layout_model = layout_model or pretrained.get("layout_model")
+        self.layout_processor = layout_processor or pretrained.get("layout_processor")
+        self.ocr_pipeline = ocr_pipeline or pretrained.get("ocr_pipeline")
+
+    def release(self):
+        # Drop the page image and its tables once the page has been processed
+        self.page = None
+        self.tables = None
 
     def rotate(self, delta=0.5, limit=5, custom_angle=None):
+        from unskewing import correct_skew
+
         _, corrected = correct_skew(np.array(self.page), delta, limit, custom_angle)
         self.page = Image.fromarray(corrected)
 
     def binarize(self, method="otsu", block_size=None, constant=None):
+        from binarization import binarize
+
         self.page = binarize(self.page, method, block_size, constant)
 
-    def detect_tables(self):
-        [line_prediction] = batch_text_detection(
-            [self.page], self.det_model, self.det_processor
-        )
-        [layout_prediction] = batch_layout_detection(
-            [self.page],
-            self.layout_model,
-            self.layout_processor,
-            [line_prediction],
-        )
+    def preprocess(self, unskew=0, binarize=0):
+        if self.preprocessed:
+            return
 
-        return [bbox for bbox in layout_prediction.bboxes if bbox.label == "Table"]
+        if unskew:
+            self.rotate(delta=0.5, limit=5)
+
+        if binarize:
+            self.binarize(method="otsu", block_size=31, constant=10)
+
+        self.preprocessed = True
+        self.binarized = bool(binarize)
+
+    def detect_tables(self):
+        batch_detect_tables([self])
+        return self.table_bboxes
 
     def process_page(self, **kwargs):
         stop_event = kwargs.get("stop_event")
@@ -79,10 +114,15 @@ class Page:
             "surya+paddle": self.get_page_tables_surya_plus_paddle,
             "pdf-text": self.get_page_tables_with_pdf_text,
             "textract": self.get_page_tables_textract,
+            "textract-async": self.get_page_tables_textract_async,
             "textract-pickle-debug": self.get_page_tables_textract_pickle,
         }
 
-        tables = get_page_tables_method[self.document.method](**kwargs)
+        if self.cached_tables is not None:
+            tables = self.cached_tables
+        else:
+            tables = get_page_tables_method[self.document.method](**kwargs)
+            self.cache_tables(tables, stop_event)
 
         for i, table in enumerate(tables):
             if stop_event and stop_event.is_set():
@@ -115,35 +155,85 @@ class Page:
 
             table.add_to_sheet(self.page_num, i + 1, table_matrix, table.footer_text)
 
+    def load_cached_tables(self, **kwargs):
+        # Must run on the page as rendered, before it is preprocessed. The
+        # raw table data is cached, so only post-processing options can change
+        cache = self.document.page_cache
+        if not cache or self.document.method not in CACHED_METHODS:
+            return False
+        if self.cache_key is not None:
+            return self.cached_tables is not None
+
+        image = np.asarray(self.page)
+        self.cache_key = hash_key(
+            image.tobytes(),
+            image.shape,
+            self.document.method,
+            self.document.render_scale,
+            (
+                (self.document.layout_scale, pretrained.engine)
+                if self.document.method == "surya+paddle"
+                else None
+            ),
+            {option: kwargs.get(option) for option in CACHED_STAGE_OPTIONS},
+        )
+        cached = cache.get(self.cache_key)
+        if cached is None:
+            return False
+
+        self.cached_tables = []
+        for entry in json.loads(cached):
+            t = Table(None, self, entry["bbox"])
+            t.set_table_from_cache(entry["table_data"], entry["footer_text"])
+            self.cached_tables.append(t)
+
+        return True
+
+    def cache_tables(self, tables, stop_event=None):
+        # A stopped page may be missing tables
+        if not self.cache_key or (stop_event and stop_event.is_set()):
+            return
+
+        entries = [
+            {
+                "bbox": t.table_bbox,
+                "table_data": t.table_data,
+                "footer_text": t.footer_text,
+            }
+            for t in tables
+        ]
+        self.document.page_cache.set(
+            self.cache_key, json.dumps(entries, default=to_json).encode()
+        )
+
     def get_page_tables_surya_plus_paddle(self, **kwargs):
         stop_event = kwargs.get("stop_event")
         if stop_event and stop_event.is_set():
             return []
 
-        self.set_models(**pretrained.all_models())
+        self.set_models()
+        self.preprocess(kwargs.get("unskew"), kwargs.get("binarize"))
 
-        if kwargs.get("unskew"):
-            self.rotate(delta=0.5, limit=5)
+        if self.table_bboxes is None:
+            self.detect_tables()
 
-        if kwargs.get("binarize"):
-            self.binarize(method="otsu", block_size=31, constant=10)
+        if self.tables is None:
+            batch_recognize_structure(
+                self.create_surya_tables(),
+                kwargs.get("heuristic_thresh"),
+                kwargs.get("structure_batch_size"),
+            )
+
+        if any(t.table_data is None for t in self.tables):
+            ocr_queue = OcrQueue(self.ocr_pipeline, stop_event=stop_event)
+            self.enqueue_texts(ocr_queue, **kwargs)
+            ocr_queue.flush()
 
         tables = []
-        for table in self.detect_tables():
+        for t in self.tables:
             if stop_event and stop_event.is_set():
                 return tables
 
-            t = Table(
-                self.page,
-                self,
-                table.bbox,
-                self.model,
-                self.processor,
-                self.det_model,
-                self.det_processor,
-                self.ocr_pipeline,
-            )
-
             t.set_table_from_surya_paddle(
                 image_pad=kwargs.get("image_pad"),
                 heuristic_thresh=kwargs.get("heuristic_thresh"),
@@ -151,11 +241,59 @@ class Page:
                 show_cropped_bboxes=kwargs.get("show_cropped_bboxes"),
                 show_detected_boxes=kwargs.get("show_detected_boxes"),
                 stop_event=stop_event,
+                image_pad_ratio=kwargs.get("image_pad_ratio"),
             )
             tables.append(t)
 
         return tables
 
+    def create_surya_tables(self):
+        self.set_models()
+        self.tables = []
+        for table in self.table_bboxes:
+            table_bbox, cropped_img = table.bbox, None
+            if self.document.two_pass:
+                table_bbox, cropped_img = self.render_table(table.bbox)
+
+            self.tables.append(
+                Table(
+                    self.page,
+                    self,
+                    table_bbox,
+                    self.model,
+                    self.processor,
+                    self.det_model,
+                    self.det_processor,
+                    self.ocr_pipeline,
+                    cropped_img,
+                )
+            )
+
+        return self.tables
+
+    def render_table(self, bbox):
+        # The page was rendered at low resolution for layout detection, only
+        # the table region is rendered again at full resolution
+        from binarization import binarize
+
+        cropped_img = self.document.render_region(self.page_num, bbox)
+        if self.binarized:
+            cropped_img = binarize(cropped_img, "otsu", 31, 10)
+
+        ratio = self.document.render_scale / self.document.layout_scale
+        return [c * ratio for c in bbox], cropped_img
+
+    def enqueue_texts(self, ocr_queue, **kwargs):
+        for t in self.tables:
+            t.stop_event = kwargs.get("stop_event")
+            t.enqueue_texts(
+                ocr_queue,
+                kwargs.get("image_pad"),
+                kwargs.get("compute_prefix"),
+                kwargs.get("show_cropped_bboxes"),
+                kwargs.get("image_pad_ratio"),
+            )
+
     def get_page_tables_with_pdf_text(self, **kwargs):
         stop_event = kwargs.get("stop_event")
         tables = []
@@ -178,14 +316,31 @@ class Page:
         if stop_event and stop_event.is_set():
             return []
 
-        if kwargs.get("unskew"):
-            self.rotate(delta=0.5, limit=5)
+        self.preprocess(kwargs.get("unskew"), kwargs.get("binarize"))
+        # Already set if the page batch was sent concurrently
+        if self.textract_response is None:
+            from textract import response_cache
+
+            self.textract_response = self.get_textract_response(
+                kwargs.get("textract_endpoint_url"),
+                kwargs.get("textract_tps"),
+                response_cache(
+                    kwargs.get("textract_cache"),
+                    kwargs.get("textract_cache_max_mb"),
+                    kwargs.get("textract_offline"),
+                ),
+            )
+        return self.build_textract_tables(
+            TextractBlocks(self.textract_response["Blocks"])
+        )
 
-        if kwargs.get("binarize"):
-            self.binarize(method="otsu", block_size=31, constant=10)
+    def get_page_tables_textract_async(self, **kwargs):
+        stop_event = kwargs.get("stop_event")
+        if stop_event and stop_event.is_set():
+            return []
 
-        response = self.get_textract_response()
-        return self.build_textract_tables_from_response(response)
+        blocks, page = self.document.textract_jobs.page_blocks(self.page_num)
+        return self.build_textract_tables(blocks, page)
 
     def get_page_tables_textract_pickle(self, **kwargs):
         stop_event = kwargs.get("stop_event")
@@ -195,35 +350,32 @@ class Page:
         with open(kwargs.get("textract_response_pickle_file"), "rb") as f:
             response = pickle.load(f)
 
-        return self.build_textract_tables_from_response(response)
+        return self.build_textract_tables(TextractBlocks(response["Blocks"]))
 
-    def get_textract_response(self):
+    def textract_image_bytes(self):
         self.page = self.page.convert("RGB")
         self.page = maybe_reduce_resolution(self.page)
-        self.page = image_below_size(self.page, ONE_MB)
-        textract = boto3.client("textract", **get_aws_credentials())
-        img_byte_arr = io.BytesIO()
-        self.page.save(img_byte_arr, format="JPEG")
-        img_byte_arr = img_byte_arr.getvalue()
+        # Sent as encoded, never decoded and encoded again
+        img_byte_arr = jpeg_below_size(self.page, ONE_MB)
 
         # Analyze file directly (small enough after auto resize below 1MB)
         assert len(img_byte_arr) <= MAX_TEXTRACT_SYNC_SIZE
 
-        return textract.analyze_document(
-            Document={"Bytes": img_byte_arr},
-            FeatureTypes=["TABLES"],
-        )
+        return img_byte_arr
+
+    def get_textract_response(self, endpoint_url=None, tps=5, cache=None):
+        from textract import cached_analyze_document
 
-    def build_textract_tables_from_response(self, response):
-        blocks = response["Blocks"]
-        file_tables = [block for block in blocks if block["BlockType"] == "TABLE"]
-        id_to_block = {block["Id"]: block for block in blocks}
+        return cached_analyze_document(
+            self.textract_image_bytes(), endpoint_url, tps, cache
+        )
 
+    def build_textract_tables(self, blocks, page=1):
         tables = []
-        for table in file_tables:
+        for table in blocks.tables(page):
             bbox = self.get_textract_table_bbox(table)
             t = Table(self.page, self, bbox)
-            t.set_table_from_textract_pickle(table, id_to_block)
+            t.set_table_from_textract(blocks, table)
             tables.append(t)
 
         return tables
@@ -235,5 +387,30 @@ class Page:
         return [x, y, x + width, y + height]
 
     def to_int(self, img, y, x):
+        # Without a rendered page, bboxes stay relative to the page size
+        if img is None:
+            return y, x
+
         w, h = img.size
         return int(y * h), int(x * w)
+
+
+def batch_detect_tables(pages):
+    from surya.detection import batch_text_detection
+    from surya.layout import batch_layout_detection
+
+    images = [page.page for page in pages]
+    line_predictions = batch_text_detection(
+        images, pretrained.get("det_model"), pretrained.get("det_processor")
+    )
+    layout_predictions = batch_layout_detection(
+        images,
+        pretrained.get("layout_model"),
+        pretrained.get("layout_processor"),
+        line_predictions,
+    )
+
+    for page, layout_prediction in zip(pages, layout_predictions):
+        page.table_bboxes = [
+            bbox for bbox in layout_prediction.bboxes if bbox.label == "Table"
+        ]
@@ -0,0 +1,71 @@
+import pymupdf
+import pypdfium2
+import threading
+from PIL import Image
+
+
+# The PDF libraries are not thread safe. With read ahead or the pipeline,
+# pages are rendered by another thread than table regions, so every call on
+# a document holds its lock
+class PdfiumBackend:
+    def __init__(self, source):
+        self.pdf = pypdfium2.PdfDocument(source)
+        self.lock = threading.Lock()
+
+    @property
+    def page_count(self):
+        with self.lock:
+            return len(self.pdf)
+
+    def render(self, page_num, scale, clip=None):
+        # clip is (x1, y1, x2, y2) in PDF points from the top left corner
+        with self.lock:
+            page = self.pdf[page_num - 1]
+            crop = (0, 0, 0, 0)
+            if clip:
+                width, height = page.get_size()
+                x1, y1, x2, y2 = clip
+                crop = (max(0, x1), max(0, height - y2), max(0, width - x2), max(0, y1))
+            image = page.render(scale=scale, crop=crop).to_pil()
+            page.close()
+        return image
+
+    def text_page(self, page_num):
+        raise ValueError("The pdfium backend does not support PDF text tables")
+
+
+class PymupdfBackend:
+    def __init__(self, source):
+        self.pdf = (
+            pymupdf.open(source)
+            if isinstance(source, str)
+            else pymupdf.open("pdf", source)
+        )
+        self.lock = threading.Lock()
+
+    @property
+    def page_count(self):
+        with self.lock:
+            return self.pdf.page_count
+
+    def render(self, page_num, scale, clip=None):
+        with self.lock:
+            page = self.pdf.load_page(page_num - 1)
+            if clip:
+                clip = pymupdf.Rect(clip) & page.rect
+            pixmap = page.get_pixmap(matrix=pymupdf.Matrix(scale, scale), clip=clip)
+        return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+    def text_page(self, page_num):
+        with self.lock:
+            return self.pdf.load_page(page_num - 1)
+
+
+PDF_BACKENDS = {
+    "pdfium": PdfiumBackend,
+    "pymupdf": PymupdfBackend,
+}
+
+
+def open_pdf(source, backend="pdfium"):
+    return PDF_BACKENDS[backend](source)
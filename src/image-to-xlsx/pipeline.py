@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+from utils import batched
+
+DONE = object()
+
+
+class Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class StageQueue:
+    # Bounded queue between two pipeline stages. Records the queue depth after
+    # each put and how long each side was blocked waiting for the other
+    def __init__(self, name, maxsize, abort):
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.abort = abort
+        self.depths = []
+        self.put_wait = 0
+        self.get_wait = 0
+
+    def put(self, item):
+        # False if the pipeline was aborted and the item dropped
+        start = time.perf_counter()
+        queued = False
+        while not queued and not self.abort.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                queued = True
+            except queue.Full:
+                pass
+        self.put_wait += time.perf_counter() - start
+        self.depths.append(self.queue.qsize())
+        return queued
+
+    def __iter__(self):
+        while not self.abort.is_set():
+            start = time.perf_counter()
+            try:
+                item = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            finally:
+                self.get_wait += time.perf_counter() - start
+
+            if item is DONE:
+                return
+            if isinstance(item, Failure):
+                raise item.error
+            yield item
+
+    def metrics(self):
+        return {
+            "mean depth": sum(self.depths) / len(self.depths) if self.depths else 0,
+            "max depth": max(self.depths, default=0),
+            "producer blocked": self.put_wait,
+            "consumer blocked": self.get_wait,
+        }
+
+
+def run_pipeline(items, process, write, batch_size=1, queue_size=2):
+    # items is consumed in a producer thread, so the work of the generator
+    # (rendering, preprocessing) overlaps with process, which runs on batches
+    # of items in the calling thread. Its results are written by a writer thread
+    abort = threading.Event()
+    ready = StageQueue("preprocessed pages", queue_size, abort)
+    processed = StageQueue("processed pages", queue_size, abort)
+    write_errors = []
+
+    def produce():
+        try:
+            for item in items:
+                if not ready.put(item):
+                    # Aborted, the remaining items are not produced
+                    break
+            else:
+                ready.put(DONE)
+        except Exception as e:
+            ready.put(Failure(e))
+        finally:
+            # Ends the work of a generator, e.g. its pages rendered ahead
+            if hasattr(items, "close"):
+                items.close()
+
+    def consume():
+        try:
+            for result in processed:
+                write(result)
+        except Exception as e:
+            write_errors.append(e)
+            abort.set()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    writer = threading.Thread(target=consume, daemon=True)
+    producer.start()
+    writer.start()
+    try:
+        for batch in batched(ready, batch_size):
+            # The partial batch left when the pipeline was aborted is dropped
+            if abort.is_set() or not processed.put(process(batch)):
+                break
+        processed.put(DONE)
+        writer.join()
+    finally:
+        abort.set()
+
+    if write_errors:
+        raise write_errors[0]
+
+    return [(q.name, q.metrics()) for q in [ready, processed]]
+
+
+def print_metrics(metrics):
+    for name, m in metrics:
+        print(
+            f"    Queue of {name}: mean depth {m['mean depth']:.1f}, "
+            f"max {m['max depth']}, producer blocked {m['producer blocked']:.1f}s, "
+            f"consumer blocked {m['consumer blocked']:.1f}s"
+        )
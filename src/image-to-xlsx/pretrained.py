@@ -1,48 +1,133 @@
-from paddlex import create_pipeline
-from surya.settings import settings
-from surya.model.table_rec.model import load_model as load_model
-from surya.model.table_rec.processor import load_processor
-from surya.model.detection.model import (
-    load_model as load_det_model,
-    load_processor as load_det_processor,
-)
+import threading
+
+
+SURYA_MODELS = ["model", "layout_model", "det_model"]
+engine = "torch"
+
+
+def set_engine(new_engine):
+    global engine
+    if new_engine == engine:
+        return
+
+    registry.release(SURYA_MODELS)
+    engine = new_engine
+
+
+def maybe_onnx_model(model, name):
+    if engine == "torch":
+        return model
+
+    import onnx_engine
+
+    quantize = engine == "onnx-int8"
+    if name == "model":
+        return onnx_engine.onnx_table_rec_model(model, quantize)
+
+    processor_name = name.replace("model", "processor")
+    return onnx_engine.OnnxDetectionModel(model, get(processor_name), quantize)
 
 
 def model():
-    return load_model()
+    from surya.model.table_rec.model import load_model
+
+    return maybe_onnx_model(load_model(), "model")
 
 
 def processor():
+    from surya.model.table_rec.processor import load_processor
+
     return load_processor()
 
 
 def layout_model():
-    return load_det_model(checkpoint=settings.LAYOUT_MODEL_CHECKPOINT)
+    from surya.settings import settings
+    from surya.model.detection.model import load_model as load_det_model
+
+    return maybe_onnx_model(
+        load_det_model(checkpoint=settings.LAYOUT_MODEL_CHECKPOINT), "layout_model"
+    )
 
 
 def layout_processor():
+    from surya.settings import settings
+    from surya.model.detection.model import load_processor as load_det_processor
+
     return load_det_processor(checkpoint=settings.LAYOUT_MODEL_CHECKPOINT)
 
 
 def det_model():
-    return load_det_model()
+    from surya.model.detection.model import load_model as load_det_model
+
+    return maybe_onnx_model(load_det_model(), "det_model")
 
 
 def det_processor():
+    from surya.model.detection.model import load_processor as load_det_processor
+
     return load_det_processor()
 
 
 def ocr_pipeline():
+    from paddlex import create_pipeline
+
     return create_pipeline(pipeline="OCR")
 
 
-def all_models():
-    return {
-        "model": model(),
-        "processor": processor(),
-        "layout_model": layout_model(),
-        "layout_processor": layout_processor(),
-        "det_model": det_model(),
-        "det_processor": det_processor(),
-        "ocr_pipeline": ocr_pipeline(),
+class ModelRegistry:
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self.models = {}
+        self.locks = {name: threading.Lock() for name in loaders}
+
+    def get(self, name):
+        if name in self.models:
+            return self.models[name]
+
+        # Only one thread loads a given model, the rest wait and reuse it
+        with self.locks[name]:
+            if name not in self.models:
+                self.models[name] = self.loaders[name]()
+
+        return self.models[name]
+
+    def warm_up(self, names=None):
+        for name in names or self.loaders:
+            self.get(name)
+
+    def release(self, names=None):
+        for name in names or list(self.loaders):
+            with self.locks[name]:
+                self.models.pop(name, None)
+
+    def is_loaded(self, name):
+        return name in self.models
+
+
+registry = ModelRegistry(
+    {
+        "model": model,
+        "processor": processor,
+        "layout_model": layout_model,
+        "layout_processor": layout_processor,
+        "det_model": det_model,
+        "det_processor": det_processor,
+        "ocr_pipeline": ocr_pipeline,
     }
+)
+
+
+def get(name):
+    return registry.get(name)
+
+
+def warm_up(names=None):
+    registry.warm_up(names)
+
+
+def release(names=None):
+    registry.release(names)
+
+
+def all_models():
+    return {name: registry.get(name) for name in registry.loaders}
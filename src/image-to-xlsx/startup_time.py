@@ -0,0 +1,73 @@
+# Measure how long each method takes to start in a fresh process and which
+# heavy dependencies it loads. Cheap methods must never load them.
+# Usage: python startup_time.py
+import json
+import pickle
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+HEAVY_MODULES = ["torch", "boto3", "surya", "paddlex", "tabled"]
+CHEAP_METHODS = ["pdf-text", "textract-pickle-debug"]
+METHODS = CHEAP_METHODS + ["textract", "surya+paddle"]
+
+SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+import_time = time.perf_counter() - start
+method, pdf_path, pickle_path = sys.argv[1:]
+if method in {cheap_methods}:
+    document = {{"name": pdf_path, "path": pdf_path, "pages": [(1, 1)]}}
+    main.run(document, method=method, textract_response_pickle_file=pickle_path)
+print(json.dumps({{
+    "import_seconds": import_time,
+    "total_seconds": time.perf_counter() - start,
+    "heavy_modules": [m for m in {heavy_modules} if m in sys.modules],
+}}))
+"""
+
+
+def write_sample_inputs(tmp_dir):
+    import pymupdf
+
+    pdf_path = Path(tmp_dir) / "sample.pdf"
+    pdf = pymupdf.open()
+    pdf.new_page().insert_text((72, 72), "Year  Exports\n1840  100\n1841  200")
+    pdf.save(pdf_path)
+
+    pickle_path = Path(tmp_dir) / "sample.pkl"
+    with open(pickle_path, "wb") as f:
+        pickle.dump({"Blocks": []}, f)
+
+    return pdf_path, pickle_path
+
+
+def measure_startup(method):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path, pickle_path = write_sample_inputs(tmp_dir)
+        script = SCRIPT.format(cheap_methods=CHEAP_METHODS, heavy_modules=HEAVY_MODULES)
+        output = subprocess.run(
+            [sys.executable, "-c", script, method, str(pdf_path), str(pickle_path)],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+    return {"method": method, **json.loads(output.splitlines()[-1])}
+
+
+if __name__ == "__main__":
+    failed = False
+    for method in METHODS:
+        result = measure_startup(method)
+        print(
+            f"{method:>22}: import {result['import_seconds']:.2f}s, "
+            f"total {result['total_seconds']:.2f}s, "
+            f"heavy modules {result['heavy_modules'] or 'none'}"
+        )
+        failed |= method in CHEAP_METHODS and bool(result["heavy_modules"])
+
+    sys.exit(1 if failed else 0)
@@ -1,8 +1,8 @@
 import numpy as np
-import cv2
 import pretrained
+from ocr import OcrQueue
 import re
-from utils import split_footnotes, get_cell_color
+from utils import split_footnotes
 from collections import defaultdict
 from definitions import (
     MISSPELLINGS,
@@ -10,14 +10,10 @@ from definitions import (
     NOT_NUMBER,
     ONE_NUMBER,
     AT_LEAST_TWO_NUMBERS,
+    MIN_IMAGE_PAD,
 )
 from PIL import Image
-from surya.detection import batch_text_detection
-from surya.tables import batch_table_recognition
-from tabled.assignment import assign_rows_columns
 from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
-from openpyxl.styles import PatternFill, Border, Side
-from openpyxl.comments import Comment
 
 
 class Table:
@@ -31,95 +27,120 @@ class Table:
         det_model=None,
         det_processor=None,
         ocr_pipeline=None,
+        cropped_img=None,
     ):
         self.page = page
         self.footer_text = None
+        self.table = None
+        self.table_data = None
+        self.table_array = None
+
+        # Tables restored from the page cache, or from textract-async, have no
+        # image to crop
+        if whole_image is None:
+            self.table_bbox = table_bbox
+            return
 
         if not page.document.method == "pdf-text":
             self.image = whole_image
-            self.cropped_img = self.image.crop(table_bbox)
+            self.cropped_img = (
+                self.image.crop(table_bbox) if cropped_img is None else cropped_img
+            )
             self.table_bbox = table_bbox
-            self.model = model or pretrained.model
-            self.processor = processor or pretrained.processor
-            self.det_model = det_model or pretrained.det_model
-            self.det_processor = det_processor or pretrained.det_processor
-            self.pipeline = ocr_pipeline or pretrained.ocr_pipeline
+
+        if page.document.method == "surya+paddle":
+            self.model = model or pretrained.get("model")
+            self.processor = processor or pretrained.get("processor")
+            self.det_model = det_model or pretrained.get("det_model")
+            self.det_processor = det_processor or pretrained.get("det_processor")
+            self.pipeline = ocr_pipeline or pretrained.get("ocr_pipeline")
 
     def reject_large_bboxes(self, bboxes, thresh=30):
         return [tb for tb in bboxes if tb.bbox[3] - tb.bbox[1] <= thresh]
 
     def recognize_structure(self, heuristic_thresh=0.8):
-        table_blocks = []
+        batch_recognize_structure([self], heuristic_thresh)
 
-        [det_result] = batch_text_detection(
-            [self.cropped_img], self.det_model, self.det_processor
-        )
-        self.det_result = det_result
-        det_result.bboxes = self.reject_large_bboxes(det_result.bboxes)
+    def is_numeric_cell(self, text, threshold=0.6):
+        numeric = sum("0" <= c <= "9" for c in text)
+        return numeric >= threshold * len(text)
 
-        if table_blocks:
-            cell_bboxes = table_blocks
-        else:
-            cell_bboxes = [{"bbox": tb.bbox, "text": ""} for tb in det_result.bboxes]
+    def get_cell_box(self, cell):
+        if self.table_array is None:
+            self.table_array = np.asarray(self.table["img"].convert("RGB"))
 
-        self.table = {
-            "bbox": self.table_bbox,
-            "img": self.cropped_img,
-            "bboxes": cell_bboxes,
-        }
+        h, w = self.table_array.shape[:2]
+        x1, y1, x2, y2 = [int(round(x)) for x in cell.bbox]
+        x1, x2 = min(max(0, x1), w), min(max(0, x2), w)
+        y1, y2 = min(max(0, y1), h), min(max(0, y2), h)
+        return x1, y1, max(x1, x2), max(y1, y2)
 
-        [table_pred] = batch_table_recognition(
-            [self.cropped_img], [cell_bboxes], self.model, self.processor
-        )
+    def get_cell_image_pad(self, cell, image_pad, image_pad_ratio=0):
+        if not image_pad_ratio:
+            return image_pad
+
+        # Padding proportional to the cell height, so small cells stay small
+        _, y1, _, y2 = self.get_cell_box(cell)
+        return min(image_pad, max(MIN_IMAGE_PAD, round(image_pad_ratio * (y2 - y1))))
 
-        self.table["cells"] = assign_rows_columns(
-            table_pred, self.table["img"].size, heuristic_thresh
+    def get_cropped_cell_shape(self, cell, image_pad):
+        x1, y1, x2, y2 = self.get_cell_box(cell)
+        return (y2 - y1 + 2 * image_pad, x2 - x1 + 2 * image_pad, 3)
+
+    def get_cropped_cell_image(
+        self, cell, image_pad, show_cropped_bboxes=False, out=None
+    ):
+        # Copies the cell straight from the table pixels into a white canvas,
+        # which may be a view into a buffer shared by a whole OCR batch
+        if out is None:
+            out = np.full(self.get_cropped_cell_shape(cell, image_pad), 255, np.uint8)
+
+        x1, y1, x2, y2 = self.get_cell_box(cell)
+        out[image_pad : image_pad + y2 - y1, image_pad : image_pad + x2 - x1] = (
+            self.table_array[y1:y2, x1:x2]
         )
+        if show_cropped_bboxes:
+            Image.fromarray(out).show()
 
-    def is_numeric_cell(self, text, threshold=0.6):
-        numeric = sum("0" <= c <= "9" for c in text)
-        return numeric >= threshold * len(text)
+        return out
+
+    def enqueue_texts(
+        self,
+        ocr_queue,
+        image_pad,
+        compute_prefix,
+        show_cropped_bboxes,
+        image_pad_ratio=0,
+    ):
+        self.table_data = defaultdict(lambda: defaultdict(list))
 
-    def get_cropped_cell_images(self, image_pad, compute_prefix, show_cropped_bboxes):
-        cropped_imgs = []
         for cell in self.table["cells"][:compute_prefix]:
             stop_event = getattr(self, "stop_event", None)
             if stop_event and stop_event.is_set():
                 break
 
-            cropped_img = np.array(self.table["img"].crop(cell.bbox))
-            cropped_img = np.pad(
-                cropped_img,
-                ((image_pad, image_pad), (image_pad, image_pad), (0, 0)),
-                mode="constant",
-                constant_values=255,
-            )
-            if show_cropped_bboxes:
-                Image.fromarray(cropped_img).show()
-            cropped_imgs.append(cropped_img)
+            cell_image_pad = self.get_cell_image_pad(cell, image_pad, image_pad_ratio)
+            ocr_queue.put(self, cell, cell_image_pad, show_cropped_bboxes)
 
-        return cropped_imgs
+    def add_cell_text(self, cell, pred):
+        row_ids, col_ids = cell.row_ids, cell.col_ids
+        row_id, col_id = row_ids[0], col_ids[0]
 
-    def recognize_texts(self, image_pad, compute_prefix, show_cropped_bboxes):
-        self.table_data = defaultdict(lambda: defaultdict(list))
+        self.table_data[row_id][col_id] += [
+            {"text": text, "confidence": confidence * 100}
+            for text, confidence in zip(pred["rec_text"], pred["rec_score"])
+        ]
 
-        cropped_imgs = self.get_cropped_cell_images(
-            image_pad, compute_prefix, show_cropped_bboxes
+    def recognize_texts(
+        self, image_pad, compute_prefix, show_cropped_bboxes, image_pad_ratio=0
+    ):
+        ocr_queue = OcrQueue(
+            self.pipeline, stop_event=getattr(self, "stop_event", None)
         )
-        output = self.pipeline.predict(cropped_imgs)
-
-        for cell, pred in zip(self.table["cells"], output):
-            stop_event = getattr(self, "stop_event", None)
-            if stop_event and stop_event.is_set():
-                break
-
-            row_ids, col_ids = cell.row_ids, cell.col_ids
-            row_id, col_id = row_ids[0], col_ids[0]
-
-            self.table_data[row_id][col_id] += [
-                {"text": text, "confidence": confidence * 100}
-                for text, confidence in zip(pred["rec_text"], pred["rec_score"])
-            ]
+        self.enqueue_texts(
+            ocr_queue, image_pad, compute_prefix, show_cropped_bboxes, image_pad_ratio
+        )
+        ocr_queue.flush()
 
     def set_table_from_pdf_text(self, table):
         self.table_data = defaultdict(dict)
@@ -127,94 +148,23 @@ class Table:
             for j, col in enumerate(row):
                 self.table_data[i][j] = [{"text": col, "confidence": None}]
 
-    def set_table_from_textract_pickle(self, textract_table, id_to_block):
-        # TODO: Check merged cells
-        table_cells = [
-            id_to_block[id]
-            for relationship in textract_table.get("Relationships", [])
-            for id in relationship["Ids"]
-            if id_to_block[id]["BlockType"] == "CELL"
-        ]
-
-        self.table_data = defaultdict(lambda: defaultdict(list))
-        for cell in table_cells:
-            words = [
-                id_to_block[id]
-                for relationship in cell.get("Relationships", [])
-                for id in relationship["Ids"]
-                if id_to_block[id]["BlockType"] == "WORD"
-            ]
-            row, col = cell["RowIndex"], cell["ColumnIndex"]
-            self.table_data[row - 1][col - 1] = [
-                {"text": word["Text"], "confidence": word["Confidence"]}
-                for word in words
-            ]
-
-        self.footer_text = self.get_table_footer_text(textract_table, id_to_block)
-
-    def get_table_footer_text(self, table, id_to_block):
-        return "\n".join(
-            [
-                " ".join(
-                    [
-                        id_to_block[id]["Text"]
-                        for rel in footer.get("Relationships", [])
-                        if rel["Type"] == "CHILD"
-                        for id in rel["Ids"]
-                        if id_to_block[id]["BlockType"] == "WORD"
-                    ]
-                )
-                for rel in table.get("Relationships", [])
-                if rel["Type"] == "TABLE_FOOTER"
-                for footer in [id_to_block[id] for id in rel["Ids"]]
-            ]
-        )
-
-    def add_to_sheet(self, page_num, table_num, table_matrix, footer_text):
-        thin_white_border = Border(
-            left=Side(style="thin", color="FFFFFF"),
-            right=Side(style="thin", color="FFFFFF"),
-            top=Side(style="thin", color="FFFFFF"),
-            bottom=Side(style="thin", color="FFFFFF"),
-        )
-        thick_blue_border = Border(
-            left=Side(style="thick", color="0000FF"),
-            right=Side(style="thick", color="0000FF"),
-            top=Side(style="thick", color="0000FF"),
-            bottom=Side(style="thick", color="0000FF"),
-        )
-        thick_violet_border = Border(
-            left=Side(style="thick", color="FF00FF"),
-            right=Side(style="thick", color="FF00FF"),
-            top=Side(style="thick", color="FF00FF"),
-            bottom=Side(style="thick", color="FF00FF"),
-        )
-
-        self.page.document.footers_workbook.active.append(
-            [
-                page_num,
-                table_num,
-                footer_text,
-            ]
+    def set_table_from_cache(self, table_data, footer_text):
+        # JSON object keys are strings, rows and columns are ints
+        self.table_data = defaultdict(
+            lambda: defaultdict(list),
+            {
+                int(i): defaultdict(list, {int(j): cell for j, cell in row.items()})
+                for i, row in table_data.items()
+            },
         )
+        self.footer_text = footer_text
 
-        sheet_name = f"page_{page_num}_table_{table_num}"
-        sheet = self.page.document.workbook.create_sheet(sheet_name)
+    def set_table_from_textract(self, blocks, table):
+        self.table_data = blocks.table_data(table)
+        self.footer_text = blocks.footer_text(table)
 
-        for i, row in enumerate(table_matrix, 1):
-            for j, col in enumerate(row, 1):
-                cell = sheet.cell(row=i, column=j, value=col["text"])
-                cell_color = get_cell_color(col["confidence"])
-                if cell_color:
-                    cell.fill = PatternFill(start_color=cell_color, fill_type="solid")
-                    cell.border = [
-                        thin_white_border,
-                        thick_violet_border,
-                        thick_blue_border,
-                    ][col["cnt_numbers"]]
-
-                    if col["footnotes"]:
-                        cell.comment = Comment(",".join(col["footnotes"]), "automatic")
+    def add_to_sheet(self, page_num, table_num, table_matrix, footer_text):
+        self.page.document.add_table(page_num, table_num, table_matrix, footer_text)
 
     def extend_rows(self):
         split_table = []
@@ -369,13 +319,15 @@ class Table:
         show_cropped_bboxes=False,
         show_detected_boxes=False,
         stop_event=None,
+        image_pad_ratio=0,
     ):
         self.stop_event = stop_event
         if stop_event and stop_event.is_set():
             self.table_data = defaultdict(lambda: defaultdict(list))
             return
 
-        self.recognize_structure(heuristic_thresh)
+        if self.table is None:
+            self.recognize_structure(heuristic_thresh)
 
         if stop_event and stop_event.is_set():
             self.table_data = defaultdict(lambda: defaultdict(list))
@@ -384,7 +336,10 @@ class Table:
         if show_detected_boxes:
             self.visualize_table_bboxes()
 
-        self.recognize_texts(image_pad, compute_prefix, show_cropped_bboxes)
+        if self.table_data is None:
+            self.recognize_texts(
+                image_pad, compute_prefix, show_cropped_bboxes, image_pad_ratio
+            )
 
     def nlp_postprocess(
         self, table_matrix, text_language="en", nlp_postprocess_prompt_file=None
@@ -399,6 +354,8 @@ class Table:
             f_out.write(output)
 
     def visualize_bboxes(self, img, bboxes):
+        import cv2
+
         visualize_img = np.array(img, dtype=np.uint8)
         h, w, _ = visualize_img.shape
         bboxes = np.array(bboxes, dtype=np.int32)
@@ -415,3 +372,39 @@ class Table:
         self.visualize_bboxes(
             self.table["img"], [c["bbox"] for c in self.table["bboxes"]]
         )
+
+
+def batch_recognize_structure(tables, heuristic_thresh=0.8, batch_size=None):
+    from surya.detection import batch_text_detection
+    from surya.tables import batch_table_recognition
+    from tabled.assignment import assign_rows_columns
+
+    if not tables:
+        return
+
+    images = [table.cropped_img for table in tables]
+    det_results = batch_text_detection(
+        images, tables[0].det_model, tables[0].det_processor, batch_size=batch_size
+    )
+
+    for table, det_result in zip(tables, det_results):
+        table.det_result = det_result
+        det_result.bboxes = table.reject_large_bboxes(det_result.bboxes)
+        table.table = {
+            "bbox": table.table_bbox,
+            "img": table.cropped_img,
+            "bboxes": [{"bbox": tb.bbox, "text": ""} for tb in det_result.bboxes],
+        }
+
+    table_preds = batch_table_recognition(
+        images,
+        [table.table["bboxes"] for table in tables],
+        tables[0].model,
+        tables[0].processor,
+        batch_size=batch_size,
+    )
+
+    for table, table_pred in zip(tables, table_preds):
+        table.table["cells"] = assign_rows_columns(
+            table_pred, table.table["img"].size, heuristic_thresh
+        )
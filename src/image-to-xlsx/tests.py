@@ -1,5 +1,6 @@
 from main import run
 from utils import split_footnotes
+from contextlib import contextmanager
 import os
 from pathlib import Path
 import shutil
@@ -110,3 +111,693 @@ def test_split_footnotes():
     assert split_footnotes(s) == ("China, other than electrical", [])
     s = "lasto"
     assert split_footnotes(s) == ("lasto", [])
+
+
+def test_model_registry_loads_once():
+    from pretrained import ModelRegistry
+
+    calls = []
+    registry = ModelRegistry({"model": lambda: calls.append(1) or object()})
+    assert not registry.is_loaded("model")
+    first = registry.get("model")
+    assert registry.get("model") is first
+    assert len(calls) == 1
+    registry.release()
+    assert not registry.is_loaded("model")
+    registry.warm_up()
+    assert registry.get("model") is not first
+    assert len(calls) == 2
+
+
+def test_ocr_queue_batches_and_routes_cells():
+    from ocr import OcrQueue
+    from types import SimpleNamespace
+
+    class FakePipeline:
+        def __init__(self):
+            self.batches = []
+
+        def predict(self, imgs):
+            self.batches.append(len(imgs))
+            return [{"rec_text": [img], "rec_score": [1]} for img in imgs]
+
+    class FakeTable:
+        def __init__(self, name):
+            self.name = name
+            self.texts = {}
+
+        def get_cropped_cell_shape(self, cell, image_pad):
+            x1, y1, x2, y2 = cell.bbox
+            return (y2 - y1 + 2 * image_pad, x2 - x1 + 2 * image_pad, 3)
+
+        def get_cropped_cell_image(self, cell, image_pad, show_cropped_bboxes, out):
+            assert out.shape == self.get_cropped_cell_shape(cell, image_pad)
+            return f"{self.name}-{cell.row_ids[0]}-{cell.col_ids[0]}"
+
+        def add_cell_text(self, cell, pred):
+            self.texts[(cell.row_ids[0], cell.col_ids[0])] = pred["rec_text"][0]
+
+    def cell(row, col, size=10):
+        return SimpleNamespace(bbox=[0, 0, size, size], row_ids=[row], col_ids=[col])
+
+    pipeline = FakePipeline()
+    queue = OcrQueue(pipeline, batch_size=3)
+    tables = [FakeTable("a"), FakeTable("b")]
+    for table in tables:
+        for col in range(2):
+            queue.put(table, cell(0, col), image_pad=0)
+    queue.flush()
+
+    assert pipeline.batches == [3, 1]
+    assert tables[0].texts == {(0, 0): "a-0-0", (0, 1): "a-0-1"}
+    assert tables[1].texts == {(0, 0): "b-0-0", (0, 1): "b-0-1"}
+
+    # A single large crop (3 MB) goes alone to avoid going over the memory cap
+    pipeline = FakePipeline()
+    queue = OcrQueue(pipeline, batch_size=10, max_batch_mb=2)
+    queue.put(tables[0], cell(0, 0), image_pad=0)
+    queue.put(tables[0], cell(1, 0, size=1024), image_pad=0)
+    queue.flush()
+    assert pipeline.batches == [1, 1]
+
+
+def test_cheap_methods_do_not_load_heavy_dependencies():
+    from startup_time import CHEAP_METHODS, measure_startup
+
+    for method in CHEAP_METHODS:
+        result = measure_startup(method)
+        assert not result["heavy_modules"], result
+
+
+def test_correct_skew_matches_rotation():
+    from bench_unskewing import exhaustive_skew, synthetic_page
+    from unskewing import correct_skew
+
+    for angle in [-3, -0.5, 0, 2]:
+        page = synthetic_page(angle, width=1240, height=1754)
+        best_angle, corrected = correct_skew(page, delta=0.5, limit=5)
+        assert best_angle == exhaustive_skew(page, delta=0.5, limit=5)
+        assert abs(best_angle + angle) <= 0.5
+        assert corrected.shape == page.shape
+
+
+def test_cropped_cell_images_are_padded_views():
+    from table import Table
+    from types import SimpleNamespace
+    from PIL import Image
+    import numpy as np
+
+    document = SimpleNamespace(method="textract")
+    img = Image.fromarray(np.zeros((100, 200, 3), dtype=np.uint8))
+    table = Table(img, SimpleNamespace(document=document), [0, 0, 200, 100])
+    table.table = {"img": table.cropped_img}
+    cell = SimpleNamespace(bbox=[10.2, 20, 50, 30.6])
+
+    crop = table.get_cropped_cell_image(cell, image_pad=5)
+    assert crop.shape == (21, 50, 3)
+    assert (crop[5:-5, 5:-5] == 0).all()
+    assert crop[:5].min() == 255 and crop[:, -5:].min() == 255
+
+    buffer = np.full(2 * crop.size, 255, dtype=np.uint8)
+    view = table.get_cropped_cell_image(
+        cell, 5, out=buffer[: crop.size].reshape(crop.shape)
+    )
+    assert np.shares_memory(view, buffer)
+    assert (view == crop).all()
+
+    assert table.get_cell_image_pad(cell, 100) == 100
+    assert table.get_cell_image_pad(cell, 100, image_pad_ratio=2) == 22
+    assert table.get_cell_image_pad(cell, 100, image_pad_ratio=0.1) == 10
+
+
+def test_pdf_backends_render_the_same_pages():
+    from pdf_backend import PDF_BACKENDS, open_pdf
+    from startup_time import write_sample_inputs
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path, _ = write_sample_inputs(tmp_dir)
+        pdfs = [open_pdf(str(pdf_path), backend) for backend in PDF_BACKENDS]
+
+        assert {pdf.page_count for pdf in pdfs} == {1}
+        assert len({pdf.render(1, 2).size for pdf in pdfs}) == 1
+        regions = [pdf.render(1, 2, (50, 40, 250, 140)) for pdf in pdfs]
+        assert {region.size for region in regions} == {(400, 200)}
+
+
+def write_tables_pdf(pdf_path, num_pages):
+    import pymupdf
+
+    pdf = pymupdf.open()
+    for p in range(num_pages):
+        page = pdf.new_page()
+        for r in range(6):
+            for c in range(3):
+                page.insert_text((72 + c * 110, 72 + r * 18), f"{p}{r}{c} {r * c}")
+    pdf.save(pdf_path)
+
+
+def sheets(workbook):
+    return [
+        (ws.title, [[c.value for c in r] for r in ws.iter_rows()]) for ws in workbook
+    ]
+
+
+@contextmanager
+def fake_aws_credentials():
+    # boto3 needs credentials even for the stub, the real environment is
+    # restored afterwards
+    fake = {
+        "AWS_ACCESS_KEY_ID": "stub",
+        "AWS_SECRET_ACCESS_KEY": "stub",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+    saved = {name: os.environ.get(name) for name in fake}
+    os.environ.update(fake)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@contextmanager
+def textract_stub(**stub_options):
+    # Yields the stub and its endpoint URL, the server is shut down even when
+    # the test fails
+    from textract_stub import TextractStub
+
+    stub = TextractStub(**stub_options)
+    with fake_aws_credentials():
+        server = stub.serve()
+        try:
+            yield stub, f"http://127.0.0.1:{server.server_address[1]}"
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def test_page_workers_match_sequential_output():
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = Path(tmp_dir) / "tables.pdf"
+        write_tables_pdf(pdf_path, 4)
+
+        document = {"name": "tables.pdf", "path": str(pdf_path), "pages": [(1, 4)]}
+        sequential = run(document, method="pdf-text")
+        parallel = run(document, method="pdf-text", workers=2, page_batch_size=1)
+
+    assert len(sequential[0].sheetnames) == 4
+    assert sheets(parallel[0]) == sheets(sequential[0])
+    assert sheets(parallel[1]) == sheets(sequential[1])
+
+
+def test_pipeline_keeps_order_and_runs_stages_in_threads():
+    from pipeline import run_pipeline
+    import threading
+    import time
+
+    main_thread = threading.get_ident()
+    produced_in, written = set(), []
+
+    def items():
+        for i in range(7):
+            produced_in.add(threading.get_ident())
+            yield i
+
+    def write(batch):
+        assert threading.get_ident() != main_thread
+        written.extend(batch)
+
+    metrics = run_pipeline(items(), lambda b: [i * 10 for i in b], write, 3, 2)
+    assert written == [i * 10 for i in range(7)]
+    assert main_thread not in produced_in
+    assert [m["max depth"] <= 2 for _, m in metrics] == [True, True]
+
+    def failing_write(batch):
+        raise ValueError("write failed")
+
+    try:
+        run_pipeline(items(), list, failing_write, 1, 1)
+        assert False
+    except ValueError as e:
+        assert str(e) == "write failed"
+
+    # After a failure the producer stops instead of going through all items
+    produced = []
+
+    def many_items():
+        for i in range(200):
+            produced.append(i)
+            yield i
+
+    def failing_process(batch):
+        raise ValueError("process failed")
+
+    try:
+        run_pipeline(many_items(), failing_process, list, 1, 2)
+        assert False
+    except ValueError as e:
+        assert str(e) == "process failed"
+    time.sleep(0.5)
+    assert len(produced) < 10
+
+    # The partial batch left after an abort is not processed
+    processed = []
+
+    def slow_items():
+        yield from range(4)
+        time.sleep(0.5)
+        yield 4
+
+    def record_process(batch):
+        processed.append(batch)
+        return batch
+
+    try:
+        run_pipeline(slow_items(), record_process, failing_write, 3, 2)
+        assert False
+    except ValueError as e:
+        assert str(e) == "write failed"
+    assert processed == [[0, 1, 2]]
+
+
+def test_checkpoints_resume_from_first_unfinished_page():
+    from page import Page
+    import tempfile
+
+    process_page = Page.process_page
+    processed = []
+
+    def record_page(self, **kwargs):
+        processed.append(self.page_num)
+        return process_page(self, **kwargs)
+
+    def crash_on_page_3(self, **kwargs):
+        if self.page_num == 3:
+            raise RuntimeError("crash")
+        return record_page(self, **kwargs)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = Path(tmp_dir) / "tables.pdf"
+        checkpoint_dir = Path(tmp_dir) / "checkpoints"
+        write_tables_pdf(pdf_path, 4)
+        document = {"name": "tables.pdf", "path": str(pdf_path), "pages": [(1, 4)]}
+        expected = run(document, method="pdf-text")
+
+        Page.process_page = crash_on_page_3
+        try:
+            run(
+                document,
+                method="pdf-text",
+                page_batch_size=1,
+                checkpoint_dir=checkpoint_dir,
+            )
+            assert False
+        except RuntimeError:
+            pass
+        finally:
+            Page.process_page = process_page
+
+        # Options that only change the speed do not discard the checkpoints,
+        # and the pipeline's writer thread saves the remaining pages
+        Page.process_page = record_page
+        try:
+            resumed = run(
+                document,
+                method="pdf-text",
+                checkpoint_dir=checkpoint_dir,
+                ocr_batch_size=7,
+                pipeline_depth=2,
+            )
+        finally:
+            Page.process_page = process_page
+
+    assert processed == [1, 2, 3, 4]
+    assert sheets(resumed[0]) == sheets(expected[0])
+    assert sheets(resumed[1]) == sheets(expected[1])
+
+
+def test_disk_cache_evicts_least_recently_used():
+    from cache import DiskCache, hash_key
+    import tempfile
+    import time
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = DiskCache(tmp_dir, max_mb=1)
+        keys = [hash_key(b"page", i) for i in range(4)]
+        for key in keys[:3]:
+            cache.set(key, bytes(300 * 1024))
+            time.sleep(0.01)
+
+        assert cache.get(keys[0]) == bytes(300 * 1024)
+        cache.set(keys[3], bytes(300 * 1024))
+
+        assert cache.get(keys[1]) is None
+        assert [cache.get(key) is not None for key in keys] == [True, False, True, True]
+        assert hash_key(b"page", 0) == keys[0] != hash_key(b"page", "0")
+
+    # Overwriting an entry replaces its size instead of adding to it
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = DiskCache(tmp_dir, max_mb=1)
+        for _ in range(5):
+            cache.set(keys[0], bytes(100 * 1024))
+        assert cache.size == 100 * 1024
+
+
+def test_manifest_detects_changed_and_moved_documents():
+    from manifest import Manifest
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        results = root / "results"
+        source_path, output_dir = root / "a.pdf", results / "a"
+        source_path.write_bytes(b"first")
+        options = {"method": "pdf-text", "workers": 1}
+
+        manifest = Manifest(results, options)
+        assert not manifest.is_up_to_date("a.pdf", source_path, output_dir)
+        output_dir.mkdir(parents=True)
+        for name in ["a.xlsx", "footers_a.xlsx", "a.pdf"]:
+            (output_dir / name).write_bytes(b"")
+        manifest.record("a.pdf", source_path, output_dir)
+
+        manifest = Manifest(results, {**options, "workers": 4})
+        assert manifest.is_up_to_date("a.pdf", source_path, output_dir)
+        assert not Manifest(results, {**options, "method": "textract"}).is_up_to_date(
+            "a.pdf", source_path, output_dir
+        )
+
+        moved_path = root / "sub" / "b.pdf"
+        moved_path.parent.mkdir()
+        source_path.rename(moved_path)
+        moved_output_dir = results / "sub" / "b"
+        assert manifest.is_up_to_date("sub/b.pdf", moved_path, moved_output_dir)
+        assert (moved_output_dir / "footers_b.xlsx").is_file()
+        assert not output_dir.exists()
+
+        moved_path.write_bytes(b"other")
+        assert not Manifest(results, options).is_up_to_date(
+            "sub/b.pdf", moved_path, moved_output_dir
+        )
+
+
+def test_concurrent_textract_keeps_page_order():
+    import tempfile
+
+    with textract_stub(tps=3, latency=0.2) as (stub, url):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            options = {
+                "method": "textract",
+                "page_cache": 0,
+                "textract_cache": 0,
+                "textract_endpoint_url": url,
+            }
+            pdf_path = Path(tmp_dir) / "tables.pdf"
+            write_tables_pdf(pdf_path, 6)
+            document = {"name": "tables.pdf", "path": str(pdf_path), "pages": [(1, 6)]}
+            sequential = run(document, **options)
+            concurrent = run(
+                document, textract_concurrency=6, textract_tps=10, **options
+            )
+
+    # The stub throttles above 3 calls per second, throttled calls are retried
+    assert stub.throttled > 0
+    assert len(sequential[0].sheetnames) == 6
+    assert sheets(concurrent[0]) == sheets(sequential[0])
+
+
+def test_textract_client_is_reused():
+    from textract import textract_client
+
+    url = "http://127.0.0.1:1"
+    with fake_aws_credentials():
+        # A client is replaced only by one with a larger connection pool
+        small_pool = textract_client(url, 4)
+        default_pool = textract_client(url)
+        assert default_pool is not small_pool
+        assert textract_client(url, 4) is default_pool
+        large_pool = textract_client(url, 32)
+        assert large_pool is not default_pool
+        assert textract_client(url) is large_pool
+
+
+def test_textract_async_splits_chunks_into_pages():
+    import tempfile
+
+    options = {
+        "method": "textract-async",
+        "page_cache": 0,
+        "textract_s3_bucket": "bucket",
+        "textract_poll_interval": 0.1,
+    }
+
+    # Responses of 4 blocks make the jobs of 2 pages need several requests
+    with textract_stub(job_delay=0.3, max_results=4) as (stub, url):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            options["textract_endpoint_url"] = url
+            pdf_path = Path(tmp_dir) / "tables.pdf"
+            write_tables_pdf(pdf_path, 6)
+            document = {"name": "tables.pdf", "path": str(pdf_path), "pages": [(2, 6)]}
+            one_page_jobs = run(document, textract_async_chunk_pages=1, **options)
+            assert len(stub.jobs) == 5
+            chunked = run(document, textract_async_chunk_pages=2, **options)
+
+    # Pages 2-3, 4-5 and 6 go in 3 jobs, and the S3 objects are deleted
+    assert len(stub.jobs) == 8
+    assert not stub.objects
+    # The stub's table holds a hash of the page text, it differs on every page
+    assert [title for title, _ in sheets(chunked[0])] == [
+        f"page_{i}_table_1" for i in range(2, 7)
+    ]
+    assert len({str(rows) for _, rows in sheets(chunked[0])}) == 5
+    assert sheets(chunked[0]) == sheets(one_page_jobs[0])
+
+    # The documents are also deleted from the bucket when a job fails
+    with textract_stub(fail_jobs=True) as (stub, url):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            options["textract_endpoint_url"] = url
+            pdf_path = Path(tmp_dir) / "tables.pdf"
+            write_tables_pdf(pdf_path, 4)
+            document = {"name": "tables.pdf", "path": str(pdf_path), "pages": [(1, 4)]}
+            try:
+                run(document, textract_async_chunk_pages=1, **options)
+                assert False
+            except RuntimeError as e:
+                assert "Stub failure" in str(e)
+
+    assert len(stub.jobs) == 4
+    assert not stub.objects
+
+
+def test_textract_responses_are_cached_by_image():
+    from textract import (
+        ResponseCache,
+        TextractCacheMiss,
+        cached_analyze_document,
+        response_cache,
+    )
+    import tempfile
+
+    with textract_stub() as (stub, url), tempfile.TemporaryDirectory() as tmp_dir:
+        cache = ResponseCache(tmp_dir)
+        first = cached_analyze_document(b"page 1", url, cache=cache)["Blocks"]
+        assert cached_analyze_document(b"page 1", url, cache=cache)["Blocks"] == first
+        assert stub.requests == 1
+        cached_analyze_document(b"page 2", url, cache=cache)
+        assert stub.requests == 2
+
+        # Offline, cached pages are still read and others fail without a call
+        offline = ResponseCache(tmp_dir, offline=True)
+        assert cached_analyze_document(b"page 1", url, cache=offline)["Blocks"] == first
+        try:
+            cached_analyze_document(b"page 3", url, cache=offline)
+            assert False
+        except TextractCacheMiss:
+            pass
+        assert stub.requests == 2
+
+        # Responses from another endpoint are not reused
+        cached_analyze_document(
+            b"page 1", url.replace("127.0.0.1", "localhost"), cache=cache
+        )
+        assert stub.requests == 3
+
+    assert response_cache(textract_cache=0) is None
+    assert response_cache(textract_offline=1).offline
+
+
+def test_jpeg_below_size_returns_bytes_that_fit():
+    from utils import jpeg_below_size
+    from PIL import Image
+    import io
+    import numpy as np
+
+    noise = np.random.default_rng(0).normal(200, 40, (2000, 1500))
+    image = Image.fromarray(noise.clip(0, 255).astype(np.uint8)).convert("RGB")
+    target_size = 1024 * 1024
+
+    data = jpeg_below_size(image, target_size)
+    assert 0.9 * target_size <= len(data) <= target_size
+    assert Image.open(io.BytesIO(data)).size == image.size
+
+    # Small enough at the highest quality, encoded only once
+    small = image.resize((300, 200))
+    assert jpeg_below_size(small, target_size) == jpeg_below_size(small, 10**9)
+
+
+def test_textract_blocks_merge_cells_and_read_footers():
+    from textract_blocks import TextractBlocks
+
+    def word(block_id, text):
+        return {"Id": block_id, "BlockType": "WORD", "Text": text, "Confidence": 90}
+
+    def cell(block_id, row, col, *word_ids):
+        relationships = [{"Type": "CHILD", "Ids": list(word_ids)}]
+        return {
+            "Id": block_id,
+            "BlockType": "CELL",
+            "RowIndex": row,
+            "ColumnIndex": col,
+            "Relationships": relationships if word_ids else [],
+        }
+
+    # Children come before the table, like they may in Textract responses
+    blocks = [
+        word("w1", "Exports"),
+        word("w2", "1840"),
+        word("w3", "10"),
+        word("w4", "20"),
+        word("w5", "Source:"),
+        word("w6", "census"),
+        cell("c12", 1, 2, "w2"),
+        cell("c11", 1, 1, "w1"),
+        cell("c21", 2, 1, "w3"),
+        cell("c22", 2, 2, "w4"),
+        {
+            "Id": "m1",
+            "BlockType": "MERGED_CELL",
+            "Relationships": [{"Type": "CHILD", "Ids": ["c12", "c11"]}],
+        },
+        {
+            "Id": "f1",
+            "BlockType": "TABLE_FOOTER",
+            "Relationships": [{"Type": "CHILD", "Ids": ["w5", "w6"]}],
+        },
+        {
+            "Id": "t1",
+            "BlockType": "TABLE",
+            "Relationships": [
+                {"Type": "CHILD", "Ids": ["c11", "c12", "c21", "c22"]},
+                {"Type": "MERGED_CELL", "Ids": ["m1"]},
+                {"Type": "TABLE_FOOTER", "Ids": ["f1"]},
+            ],
+        },
+    ]
+    # All on the second page of an asynchronous job's response
+    index = TextractBlocks([dict(block, Page=2) for block in blocks])
+
+    assert index.tables(1) == []
+    [table] = index.tables(2)
+    table_data = index.table_data(table)
+    assert [[w["text"] for w in table_data[0][j]] for j in range(2)] == [
+        ["Exports", "1840"],
+        [],
+    ]
+    assert [[w["text"] for w in table_data[1][j]] for j in range(2)] == [
+        ["10"],
+        ["20"],
+    ]
+    assert index.footer_text(table) == "Source: census"
+
+
+def test_read_ahead_stops_when_pages_are_no_longer_read():
+    from document import PageSource
+    import threading
+    import time
+
+    rendered = []
+
+    def render_page(page_num):
+        rendered.append(page_num)
+        return page_num
+
+    pages = iter(PageSource(render_page, list(range(1, 301)), read_ahead=2))
+    assert [next(pages), next(pages)] == [(1, 1), (2, 2)]
+    pages.close()
+    time.sleep(0.5)
+    # The pages already rendered ahead, and at most the one being rendered
+    assert len(rendered) <= 6
+
+    # A render error is not left waiting forever on the full queue
+    def failing_render_page(page_num):
+        if page_num == 4:
+            raise ValueError("Broken page")
+        return page_num
+
+    threads = threading.active_count()
+    pages = iter(PageSource(failing_render_page, list(range(1, 10)), read_ahead=2))
+    assert next(pages) == (1, 1)
+    time.sleep(0.2)
+    pages.close()
+    time.sleep(0.5)
+    assert threading.active_count() == threads
+
+
+def test_onnx_engine_matches_torch_outputs():
+    import pytest
+
+    # The ONNX engine is optional
+    pytest.importorskip("onnxruntime")
+    torch = pytest.importorskip("torch")
+    import onnx_engine
+    import tempfile
+    from types import SimpleNamespace
+
+    class TinyDetectionModel(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.config = SimpleNamespace(
+                name_or_path="test/tiny-detection", to_dict=lambda: {"channels": 2}
+            )
+            self.conv = torch.nn.Conv2d(3, 2, 3, padding=1)
+
+        def forward(self, pixel_values):
+            return SimpleNamespace(logits=self.conv(pixel_values))
+
+    model = TinyDetectionModel().double()
+    processor = SimpleNamespace(size={"height": 16, "width": 24})
+    pixel_values = torch.rand(3, 3, 16, 24)
+    cache_path = onnx_engine.ONNX_CACHE_PATH
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        onnx_engine.ONNX_CACHE_PATH = tmp_dir
+        try:
+            onnx_model = onnx_engine.OnnxDetectionModel(model, processor)
+            logits = onnx_model(pixel_values).logits
+            encoder = onnx_engine.OnnxEncoder(onnx_model.session)
+            output = encoder(pixel_values=pixel_values, return_dict=True)
+
+            # New weights are exported again instead of reusing the old graph
+            retrained = TinyDetectionModel()
+            retrained_logits = onnx_engine.OnnxDetectionModel(retrained, processor)(
+                pixel_values
+            ).logits
+            assert len(list(Path(tmp_dir).glob("*.onnx"))) == 2
+        finally:
+            onnx_engine.ONNX_CACHE_PATH = cache_path
+
+    # The shared torch model is not converted to float32
+    assert model.conv.weight.dtype == torch.float64
+    with torch.inference_mode():
+        expected = model.float()(pixel_values).logits
+    assert logits.shape == (3, 2, 16, 24)
+    assert torch.allclose(logits, expected, atol=1e-5)
+    assert torch.equal(output.last_hidden_state, logits)
+    with torch.inference_mode():
+        expected = retrained(pixel_values).logits
+    assert torch.allclose(retrained_logits, expected, atol=1e-5)
@@ -0,0 +1,336 @@
+import gzip
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from cache import DiskCache, hash_key
+from definitions import TEXTRACT_CACHE_PATH
+from textract_blocks import TextractBlocks
+from utils import get_aws_credentials
+
+THROTTLING_ERRORS = {
+    "ThrottlingException",
+    "ProvisionedThroughputExceededException",
+    "LimitExceededException",
+}
+MAX_RETRIES = 8
+FEATURE_TYPES = ["TABLES"]
+
+
+class TextractCacheMiss(Exception):
+    pass
+
+
+class TokenBucket:
+    # Allows up to rate calls per second. The rate is halved every time AWS
+    # throttles a call and grows back slowly with each successful call
+    def __init__(self, rate):
+        self.max_rate = rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # No bursts, calls are spaced evenly at the current rate
+                self.tokens = min(1.0, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(0.1, self.rate / 2)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+# One bucket per process, the TPS quota is shared by all pages and documents
+limiters = {}
+limiters_lock = threading.Lock()
+
+
+def rate_limiter(tps):
+    with limiters_lock:
+        if tps not in limiters:
+            limiters[tps] = TokenBucket(tps)
+        return limiters[tps]
+
+
+# One client per process and endpoint. boto3 clients are thread safe and keep
+# their connections open, so they are shared by all pages and documents
+clients = {}
+clients_lock = threading.Lock()
+
+
+def aws_client(service, endpoint_url=None, max_pool_connections=10):
+    import boto3
+    from botocore.config import Config
+
+    credentials = get_aws_credentials()
+    key = (service, endpoint_url, tuple(sorted(credentials.items())))
+    with clients_lock:
+        client, pool_size = clients.get(key, (None, 0))
+        # A new client only if more pages are sent at once than it has connections
+        if client is None or pool_size < max_pool_connections:
+            # Throttled calls are retried by call_with_backoff, which also slows
+            # down the other threads, instead of by botocore
+            config = Config(
+                max_pool_connections=max_pool_connections,
+                retries={"total_max_attempts": 1},
+                # Local stand-ins do not have a DNS name for each bucket
+                s3={"addressing_style": "path"} if endpoint_url else None,
+            )
+            client = boto3.client(
+                service, endpoint_url=endpoint_url, config=config, **credentials
+            )
+            clients[key] = (client, max_pool_connections)
+
+    return client
+
+
+def textract_client(endpoint_url=None, max_pool_connections=10):
+    return aws_client("textract", endpoint_url, max_pool_connections)
+
+
+def call_with_backoff(call, limiter, **kwargs):
+    from botocore.exceptions import ClientError
+
+    for attempt in range(MAX_RETRIES):
+        limiter.acquire()
+        try:
+            response = call(**kwargs)
+        except ClientError as e:
+            if (
+                e.response["Error"]["Code"] not in THROTTLING_ERRORS
+                or attempt == MAX_RETRIES - 1
+            ):
+                raise
+            limiter.throttled()
+            time.sleep(min(20, 0.5 * 2**attempt) * random.uniform(0.5, 1))
+        else:
+            limiter.succeeded()
+            return response
+
+
+def analyze_document(client, image_bytes, limiter):
+    return call_with_backoff(
+        client.analyze_document,
+        limiter,
+        Document={"Bytes": image_bytes},
+        FeatureTypes=FEATURE_TYPES,
+    )
+
+
+class ResponseCache:
+    # Textract responses as gzipped JSON, keyed by the exact image bytes that
+    # were sent and the endpoint they were sent to, so responses of a local
+    # stand-in are never used for AWS. Offline, a page that was never sent
+    # is an error instead of an AWS call
+    def __init__(self, directory, max_mb=1024, offline=False):
+        self.cache = DiskCache(directory, max_mb)
+        self.offline = offline
+
+    def key(self, image_bytes, endpoint_url):
+        return hash_key(image_bytes, FEATURE_TYPES, endpoint_url)
+
+    def get(self, image_bytes, endpoint_url=None):
+        cached = self.cache.get(self.key(image_bytes, endpoint_url))
+        if cached is None and self.offline:
+            raise TextractCacheMiss("No cached Textract response for this page")
+
+        return None if cached is None else json.loads(gzip.decompress(cached))
+
+    def set(self, image_bytes, response, endpoint_url=None):
+        # The HTTP metadata of the call is not part of the result
+        response = {k: v for k, v in response.items() if k != "ResponseMetadata"}
+        self.cache.set(
+            self.key(image_bytes, endpoint_url),
+            gzip.compress(json.dumps(response, separators=(",", ":")).encode()),
+        )
+
+
+# One cache per process, shared by all pages and documents
+response_caches = {}
+response_caches_lock = threading.Lock()
+
+
+def response_cache(textract_cache=1, textract_cache_max_mb=1024, textract_offline=0):
+    if not (textract_cache or textract_offline):
+        return None
+
+    key = (textract_cache_max_mb, bool(textract_offline))
+    with response_caches_lock:
+        if key not in response_caches:
+            response_caches[key] = ResponseCache(TEXTRACT_CACHE_PATH, *key)
+        return response_caches[key]
+
+
+def cached_analyze_document(image_bytes, endpoint_url=None, tps=5, cache=None, pool=10):
+    response = cache.get(image_bytes, endpoint_url) if cache else None
+    if response is None:
+        response = analyze_document(
+            textract_client(endpoint_url, pool), image_bytes, rate_limiter(tps)
+        )
+        if cache:
+            cache.set(image_bytes, response, endpoint_url)
+
+    return response
+
+
+def fetch_responses(pages, concurrency, tps, endpoint_url=None, cache=None, **kwargs):
+    # Sends the pages concurrently and sets textract_response on each page, so
+    # the tables are still built one page at a time and in page order
+    def fetch(page):
+        page.preprocess(kwargs.get("unskew"), kwargs.get("binarize"))
+        page.textract_response = cached_analyze_document(
+            page.textract_image_bytes(), endpoint_url, tps, cache, concurrency
+        )
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        # list() raises the first error of any page
+        list(executor.map(fetch, pages))
+
+
+def page_chunks(page_nums, chunk_pages):
+    # Runs of consecutive pages, at most chunk_pages long
+    chunks = []
+    for page_num in sorted(page_nums):
+        if chunks and page_num == chunks[-1][-1] + 1 and len(chunks[-1]) < chunk_pages:
+            chunks[-1].append(page_num)
+        else:
+            chunks.append([page_num])
+    return chunks
+
+
+class AsyncTextractJobs:
+    # Runs one asynchronous Textract job for each chunk of consecutive pages.
+    # All the jobs are started at once, and the results of a chunk are only
+    # waited for when one of its pages is needed. close must be called once
+    # the document is done, it deletes the chunks still in the bucket
+    def __init__(
+        self,
+        document,
+        page_nums,
+        bucket,
+        endpoint_url=None,
+        chunk_pages=100,
+        tps=5,
+        poll_interval=5,
+    ):
+        self.bucket = bucket
+        self.textract = textract_client(endpoint_url)
+        self.s3 = aws_client("s3", endpoint_url)
+        self.limiter = rate_limiter(tps)
+        self.poll_interval = poll_interval
+        self.responses = {}
+        self.jobs = {}
+        self.prefix = f"image-to-xlsx/{uuid.uuid4().hex}"
+        # Uploaded and not deleted yet
+        self.keys = set()
+
+        try:
+            for i, chunk in enumerate(page_chunks(page_nums, chunk_pages)):
+                self.start_job(i, document, chunk)
+        except BaseException:
+            self.close()
+            raise
+
+    def start_job(self, i, document, chunk):
+        key = f"{self.prefix}/{i}{Path(document['name']).suffix}"
+        self.s3.put_object(
+            Bucket=self.bucket, Key=key, Body=chunk_bytes(document, chunk)
+        )
+        self.keys.add(key)
+        job = call_with_backoff(
+            self.textract.start_document_analysis,
+            self.limiter,
+            DocumentLocation={"S3Object": {"Bucket": self.bucket, "Name": key}},
+            FeatureTypes=["TABLES"],
+        )
+        for page_num in chunk:
+            self.jobs[page_num] = (job["JobId"], key, chunk)
+
+    def page_blocks(self, page_num):
+        # The blocks of the page's job, and the page number inside the job
+        if page_num not in self.responses:
+            self.wait_for_job(*self.jobs[page_num])
+        return self.responses.pop(page_num)
+
+    def wait_for_job(self, job_id, key, chunk):
+        blocks, next_token = [], None
+        while True:
+            kwargs = {"NextToken": next_token} if next_token else {}
+            response = call_with_backoff(
+                self.textract.get_document_analysis,
+                self.limiter,
+                JobId=job_id,
+                MaxResults=1000,
+                **kwargs,
+            )
+            status = response["JobStatus"]
+            if status == "IN_PROGRESS":
+                time.sleep(self.poll_interval)
+                continue
+            if status == "FAILED":
+                raise RuntimeError(
+                    f"Textract job failed: {response.get('StatusMessage')}"
+                )
+
+            blocks += response["Blocks"]
+            next_token = response.get("NextToken")
+            if not next_token:
+                break
+
+        self.delete(key)
+        # Indexed once for all the pages of the chunk, which are numbered from
+        # 1 inside it
+        blocks = TextractBlocks(blocks)
+        for i, page_num in enumerate(chunk, 1):
+            self.responses[page_num] = (blocks, i)
+
+    def delete(self, key):
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+        self.keys.discard(key)
+
+    def close(self):
+        # Also after an error or a cancel, the error is not hidden by a
+        # failed delete
+        for key in list(self.keys):
+            try:
+                self.delete(key)
+            except Exception as e:
+                print(f"    Could not delete s3://{self.bucket}/{key}: {e}")
+
+
+def chunk_bytes(document, chunk):
+    import pymupdf
+
+    source = document.get("path") or document["content"]
+    if document["name"].lower().endswith(".pdf"):
+        pdf = (
+            pymupdf.open(source)
+            if isinstance(source, str)
+            else pymupdf.open("pdf", source)
+        )
+        if chunk != list(range(1, pdf.page_count + 1)):
+            chunk_pdf = pymupdf.open()
+            chunk_pdf.insert_pdf(pdf, from_page=chunk[0] - 1, to_page=chunk[-1] - 1)
+            return chunk_pdf.tobytes()
+
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+
+    return source
@@ -0,0 +1,74 @@
+from collections import defaultdict
+
+
+class TextractBlocks:
+    # Blocks of a whole Textract response, grouped by page in one pass. The
+    # Id index of a page is built the first time one of its tables is read:
+    # small indexes are faster to build and look up than one for all the
+    # pages of a long document
+    def __init__(self, blocks):
+        self.pages = defaultdict(list)
+        for block in blocks:
+            # Blocks of AnalyzeDocument responses have no page
+            self.pages[block.get("Page", 1)].append(block)
+        self.indexes = {}
+
+    def index(self, page):
+        if page not in self.indexes:
+            self.indexes[page] = {block["Id"]: block for block in self.pages[page]}
+        return self.indexes[page]
+
+    def tables(self, page=1):
+        return [block for block in self.pages[page] if block["BlockType"] == "TABLE"]
+
+    def children(self, block, relationship="CHILD", block_type=None):
+        by_id = self.index(page_of(block))
+        children = [
+            by_id[id]
+            for rel in block.get("Relationships", ())
+            if rel["Type"] == relationship
+            for id in rel["Ids"]
+        ]
+        if block_type is None:
+            return children
+        return [child for child in children if child["BlockType"] == block_type]
+
+    def table_data(self, table):
+        by_id = self.index(page_of(table))
+        table_data = defaultdict(lambda: defaultdict(list))
+        for cell in self.children(table, block_type="CELL"):
+            table_data[cell["RowIndex"] - 1][cell["ColumnIndex"] - 1] = [
+                {"text": word["Text"], "confidence": word["Confidence"]}
+                for rel in cell.get("Relationships", ())
+                if rel["Type"] == "CHILD"
+                for id in rel["Ids"]
+                if (word := by_id[id])["BlockType"] == "WORD"
+            ]
+
+        # The words of a merged cell go to its top left cell, so they are not
+        # split across the columns or rows it spans
+        for merged in self.children(table, "MERGED_CELL"):
+            cells = sorted(
+                self.children(merged, block_type="CELL"),
+                key=lambda cell: (cell["RowIndex"], cell["ColumnIndex"]),
+            )
+            words = []
+            for cell in cells:
+                row = table_data[cell["RowIndex"] - 1]
+                words += row.pop(cell["ColumnIndex"] - 1, [])
+                row[cell["ColumnIndex"] - 1] = []
+            if cells:
+                top_left = table_data[cells[0]["RowIndex"] - 1]
+                top_left[cells[0]["ColumnIndex"] - 1] = words
+
+        return table_data
+
+    def footer_text(self, table):
+        return "\n".join(
+            " ".join(word["Text"] for word in self.children(footer, block_type="WORD"))
+            for footer in self.children(table, "TABLE_FOOTER")
+        )
+
+
+def page_of(block):
+    return block.get("Page", 1)
@@ -0,0 +1,205 @@
+# Local stand-in for the Textract API, to test the textract method without AWS.
+# Every page gets one table whose cells hold a hash and the size of the image.
+# It also stands in for S3 and the asynchronous document analysis of the
+# textract-async method, where a table holds a hash of the text of each page.
+# Usage: python textract_stub.py --port 8766 --tps 2 --latency 0.5
+# then: python main.py doc.pdf --method textract --textract-endpoint-url http://127.0.0.1:8766
+# or: python main.py doc.pdf --method textract-async --textract-s3-bucket any --textract-endpoint-url http://127.0.0.1:8766
+# (boto3 still needs some credentials, e.g. AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x)
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def word(block_id, text):
+    return {"Id": block_id, "BlockType": "WORD", "Text": text, "Confidence": 99.0}
+
+
+def cell(block_id, row, col, word_id):
+    return {
+        "Id": block_id,
+        "BlockType": "CELL",
+        "RowIndex": row,
+        "ColumnIndex": col,
+        "Relationships": [{"Type": "CHILD", "Ids": [word_id]}],
+    }
+
+
+def page_blocks(texts, prefix=""):
+    table = {
+        "Id": f"{prefix}table",
+        "BlockType": "TABLE",
+        "Geometry": {
+            "BoundingBox": {"Top": 0.1, "Left": 0.1, "Height": 0.5, "Width": 0.8}
+        },
+        "Relationships": [
+            {"Type": "CHILD", "Ids": [f"{prefix}cell_1", f"{prefix}cell_2"]}
+        ],
+    }
+    return [
+        {"Id": f"{prefix}page", "BlockType": "PAGE"},
+        table,
+        cell(f"{prefix}cell_1", 1, 1, f"{prefix}word_1"),
+        cell(f"{prefix}cell_2", 1, 2, f"{prefix}word_2"),
+        word(f"{prefix}word_1", texts[0]),
+        word(f"{prefix}word_2", texts[1]),
+    ]
+
+
+def analyze_document_response(image_bytes):
+    texts = [hashlib.sha256(image_bytes).hexdigest()[:8], str(len(image_bytes))]
+    return {"DocumentMetadata": {"Pages": 1}, "Blocks": page_blocks(texts)}
+
+
+def document_analysis_blocks(document_bytes):
+    # Blocks of every page, numbered from 1 in the Page field like Textract
+    import pymupdf
+
+    if document_bytes[:4] != b"%PDF":
+        texts = [hashlib.sha256(document_bytes).hexdigest()[:8], "1"]
+        return [dict(block, Page=1) for block in page_blocks(texts, "p1_")]
+
+    blocks = []
+    for page_num, page in enumerate(pymupdf.open("pdf", document_bytes), 1):
+        text = page.get_text().encode("utf-8")
+        texts = [hashlib.sha256(text).hexdigest()[:8], str(len(text))]
+        for block in page_blocks(texts, f"p{page_num}_"):
+            blocks.append(dict(block, Page=page_num))
+    return blocks
+
+
+class TextractStub:
+
+    def __init__(
+        self, tps=None, latency=0, job_delay=0, max_results=1000, fail_jobs=False
+    ):
+        self.tps = tps
+        self.latency = latency
+        # Seconds an asynchronous job stays IN_PROGRESS
+        self.job_delay = job_delay
+        # Asynchronous jobs end up FAILED instead of SUCCEEDED
+        self.fail_jobs = fail_jobs
+        # Blocks per GetDocumentAnalysis response, even if more are asked for
+        self.max_results = max_results
+        self.objects = {}
+        self.jobs = {}
+        self.calls = deque()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+
+    def throttle(self):
+        # Rejects calls above tps in any one second window, like AWS
+        with self.lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self.calls and now - self.calls[0] >= 1:
+                self.calls.popleft()
+            if self.tps and len(self.calls) >= self.tps:
+                self.throttled += 1
+                return True
+            self.calls.append(now)
+            return False
+
+    def handle(self, action, body):
+        if self.throttle():
+            return 400, {"__type": "ThrottlingException", "message": "Rate exceeded"}
+
+        time.sleep(self.latency)
+        if action == "AnalyzeDocument":
+            image_bytes = base64.b64decode(body["Document"]["Bytes"])
+            return 200, analyze_document_response(image_bytes)
+
+        if action == "StartDocumentAnalysis":
+            s3_object = body["DocumentLocation"]["S3Object"]
+            document_bytes = self.objects[(s3_object["Bucket"], s3_object["Name"])]
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = (
+                time.monotonic() + self.job_delay,
+                document_analysis_blocks(document_bytes),
+            )
+            return 200, {"JobId": job_id}
+
+        if action == "GetDocumentAnalysis":
+            ready_at, blocks = self.jobs[body["JobId"]]
+            if time.monotonic() < ready_at:
+                return 200, {"JobStatus": "IN_PROGRESS", "Blocks": []}
+            if self.fail_jobs:
+                return 200, {"JobStatus": "FAILED", "StatusMessage": "Stub failure"}
+
+            start = int(body.get("NextToken") or 0)
+            end = start + min(self.max_results, body.get("MaxResults", 1000))
+            response = {"JobStatus": "SUCCEEDED", "Blocks": blocks[start:end]}
+            if end < len(blocks):
+                response["NextToken"] = str(end)
+            return 200, response
+
+        return 400, {"__type": "InvalidParameterException", "message": action}
+
+    def serve(self, port=0):
+        # Returns the server, its port is server.server_address[1]
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keeps the connection open after boto3's Expect: 100-continue
+            protocol_version = "HTTP/1.1"
+
+            def s3_key(self):
+                bucket, _, key = self.path.split("?")[0].lstrip("/").partition("/")
+                return bucket, key
+
+            def send_empty(self, status):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_PUT(self):
+                length = int(self.headers.get("Content-Length", 0))
+                stub.objects[self.s3_key()] = self.rfile.read(length)
+                self.send_empty(200)
+
+            def do_DELETE(self):
+                stub.objects.pop(self.s3_key(), None)
+                self.send_empty(204)
+
+            def do_POST(self):
+                action = self.headers.get("X-Amz-Target", "").split(".")[-1]
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                status, response = stub.handle(action, body)
+                content = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/x-amz-json-1.1")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--tps", type=float, default=None)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--job-delay", type=float, default=0)
+    args = parser.parse_args()
+
+    stub = TextractStub(args.tps, args.latency, args.job_delay)
+    server = stub.serve(args.port)
+    print(f"Textract stub listening on port {server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(f"{stub.requests} requests, {stub.throttled} throttled")
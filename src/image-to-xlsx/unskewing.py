@@ -3,23 +3,51 @@ import cv2
 from scipy.ndimage import rotate
 
 
-def correct_skew(image, delta=1, limit=5, custom_angle=None):
-    def determine_score(arr, angle):
-        data = rotate(arr, angle, reshape=False, order=0)
-        histogram = np.sum(data, axis=1, dtype=float)
-        score = np.sum((histogram[1:] - histogram[:-1]) ** 2, dtype=float)
-        return histogram, score
-
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
-
-    scores = []
-    angles = np.arange(-limit, limit + delta, delta)
-    for angle in angles:
-        _, score = determine_score(thresh, angle)
-        scores.append(score)
-
-    best_angle = angles[scores.index(max(scores))] if not custom_angle else custom_angle
+def determine_score(arr, angle):
+    data = rotate(arr, angle, reshape=False, order=0)
+    histogram = np.sum(data, axis=1, dtype=float)
+    score = np.sum((histogram[1:] - histogram[:-1]) ** 2, dtype=float)
+    return histogram, score
+
+
+def downscale(image, max_dim):
+    h, w = image.shape[:2]
+    scale = max_dim / max(h, w)
+    if scale >= 1:
+        return image
+
+    return cv2.resize(
+        image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA
+    )
+
+
+def estimate_skew(thresh, delta=1, limit=5, coarse_factor=4):
+    scores = {}
+
+    def best_of(angles):
+        for angle in angles:
+            if angle not in scores:
+                _, scores[angle] = determine_score(thresh, angle)
+        return max(angles, key=lambda angle: scores[angle])
+
+    # All searched angles are on the same -limit + k * delta grid, so the
+    # scores of the coarse pass are reused by the fine pass
+    steps = int(round(2 * limit / delta))
+    grid = [round(-limit + k * delta, 6) for k in range(steps + 1)]
+    coarse_best = grid.index(best_of(grid[::coarse_factor] + grid[-1:]))
+    fine = grid[max(0, coarse_best - coarse_factor) : coarse_best + coarse_factor + 1]
+
+    return best_of(fine)
+
+
+def correct_skew(image, delta=1, limit=5, custom_angle=None, max_dim=1000):
+    if custom_angle:
+        best_angle = custom_angle
+    else:
+        # Scoring at low resolution is much faster and gives the same angle
+        gray = downscale(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), max_dim)
+        thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1]
+        best_angle = estimate_skew(thresh, delta, limit)
 
     (h, w) = image.shape[:2]
     center = (w // 2, h // 2)
@@ -1,5 +1,6 @@
 import re
 import configparser
+import functools
 import io
 import math
 from pathlib import Path
@@ -51,6 +52,23 @@ def get_document_paths(input_path):
     return input_path.parent, []
 
 
+def to_json(value):
+    # Numeric cells and confidences may be numpy scalars
+    return value.item()
+
+
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
 def lowest_color():
     return "B22222"
 
@@ -125,7 +143,13 @@ def _read_aws_credentials(file):
     return config
 
 
-def get_aws_credentials():
+def _aws_files_mtimes():
+    paths = [Path.home() / ".aws" / file for file in ["config", "credentials"]]
+    return tuple(path.stat().st_mtime_ns if path.is_file() else None for path in paths)
+
+
+@functools.lru_cache(maxsize=1)
+def _cached_aws_credentials(mtimes):
     conf = _read_aws_credentials("config")
     credentials = _read_aws_credentials("credentials")
     return {
@@ -139,6 +163,11 @@ def get_aws_credentials():
     }
 
 
+def get_aws_credentials():
+    # The files are parsed again only when they change
+    return dict(_cached_aws_credentials(_aws_files_mtimes()))
+
+
 # https://stackoverflow.com/a/52281257
 def image_below_size(im, target_size):
     # Min and Max quality
@@ -163,3 +192,79 @@ def image_below_size(im, target_size):
         return Image.open(result_img)
     else:
         raise Exception("No acceptable quality factor found")
+
+
+def encode_jpeg(im, quality):
+    buffer = io.BytesIO()
+    im.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+# Pixels of the downscaled copy used to predict JPEG sizes
+JPEG_PROBE_PIXELS = 250_000
+
+
+def jpeg_below_size(im, target_size, q_min=25, q_max=96, tolerance=0.1):
+    # JPEG bytes of im at nearly the highest quality below target_size. The
+    # sizes of a small downscaled copy, scaled by how the full image compared
+    # at the qualities tried, predict the quality, so it usually takes 2 or 3
+    # full size encodes instead of the 7 of image_below_size
+    data = encode_jpeg(im, q_max)
+    if len(data) <= target_size:
+        return data
+
+    factor = max(1, int(math.sqrt(im.width * im.height / JPEG_PROBE_PIXELS)))
+    probe = im.reduce(factor) if factor > 1 else im
+    probe_sizes = {}
+
+    def probe_size(quality):
+        if quality not in probe_sizes:
+            probe_sizes[quality] = len(encode_jpeg(probe, quality))
+        return probe_sizes[quality]
+
+    # Full size over probe size at each quality tried. It drifts with the
+    # quality, so it is interpolated from the two closest qualities tried
+    ratios = {q_max: len(data) / probe_size(q_max)}
+
+    def predicted_size(quality):
+        closest = sorted(ratios, key=lambda q: abs(q - quality))[:2]
+        if len(closest) == 1:
+            return probe_size(quality) * ratios[closest[0]]
+
+        q1, q2 = closest
+        r1, r2 = ratios[q1], ratios[q2]
+        return probe_size(quality) * (r1 + (r2 - r1) * (quality - q1) / (q2 - q1))
+
+    # Highest quality known to fit and lowest quality known not to
+    best, best_quality, too_big = None, q_min - 1, q_max
+    # Aim inside the accepted band, predictions are a bit off either way
+    aim = (1 - tolerance / 2) * target_size
+    while best_quality + 1 < too_big:
+        # Highest quality predicted to fit
+        low, high = best_quality + 1, too_big - 1
+        quality = None
+        while low <= high:
+            m = (low + high) // 2
+            if predicted_size(m) <= aim:
+                quality, low = m, m + 1
+            else:
+                high = m - 1
+
+        if quality is None:
+            if best is not None:
+                break
+            quality = q_min
+
+        data = encode_jpeg(im, quality)
+        ratios[quality] = len(data) / probe_size(quality)
+        if len(data) <= target_size:
+            best, best_quality = data, quality
+            if len(data) >= (1 - tolerance) * target_size:
+                break
+        else:
+            too_big = quality
+
+    if best is None:
+        raise Exception("No acceptable quality factor found")
+
+    return best